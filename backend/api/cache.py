@@ -0,0 +1,78 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from recipes.cache_versions import bump_versions, get_version, get_versions
+
+RECIPE_LIST_CACHE_PARAMS = (
+    'page', 'cursor', 'limit', 'tags', 'author', 'ordering'
+)
+
+
+def get_recipe_list_cache_key(request):
+    params = request.query_params
+    if not set(params).issubset(RECIPE_LIST_CACHE_PARAMS):
+        return None
+    query = '&'.join(
+        f'{param}={",".join(sorted(params.getlist(param)))}'
+        for param in RECIPE_LIST_CACHE_PARAMS if param in params
+    )
+    # Значения параметров приходят от клиента: в ключе memcached нельзя
+    # пробелы и больше 250 символов, поэтому строка запроса хешируется.
+    query_hash = hashlib.md5(query.encode()).hexdigest()
+    return (
+        f'recipes:list:{get_version("recipe_lists")}:'
+        f'{request.get_host()}:{query_hash}'
+    )
+
+
+def get_recipe_detail_cache_key(request, pk):
+    # /api/recipes/01/ - тот же рецепт, что и /api/recipes/1/, а сброс
+    # кеша знает только числовой id.
+    try:
+        pk = int(pk)
+    except ValueError:
+        return None
+    return (
+        f'recipes:detail:{pk}:{get_version(f"recipe_{pk}")}:'
+        f'{request.get_host()}'
+    )
+
+
+def get_recipe_snapshot_keys(recipe_ids):
+    versions = get_versions([f'recipe_{pk}' for pk in recipe_ids])
+    return {
+        pk: f'recipes:snapshot:{pk}:{versions[f"recipe_{pk}"]}'
+        for pk in recipe_ids
+    }
+
+
+def get_recipe_snapshots(keys):
+    """Снимки рецептов из кеша: {id рецепта: снимок} для найденных."""
+    cached = cache.get_many(keys.values())
+    return {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+
+def set_recipe_snapshots(keys, snapshots):
+    cache.set_many(
+        {keys[pk]: snapshot for pk, snapshot in snapshots.items()},
+        settings.RECIPE_CACHE_TIMEOUT,
+    )
+
+
+def get_cached_response(key, get_response):
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+    response = get_response()
+    if response.status_code == 200:
+        cache.set(key, response.data, settings.RECIPE_CACHE_TIMEOUT)
+    return response
+
+
+def invalidate_recipes(recipe_ids):
+    bump_versions(
+        ['recipe_lists', *(f'recipe_{pk}' for pk in recipe_ids)]
+    )
@@ -0,0 +1,88 @@
+import csv
+import io
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+CSV_HEADER = ('Ингредиент', 'Количество', 'Единица измерения')
+
+
+class ShoppingListRenderer(BaseRenderer, ABC):
+    """Список покупок отдаётся потоком через stream(), ответы с ошибками
+    RecipeViewSet.finalize_response переключает на JSON."""
+    charset = 'utf-8'
+
+    @abstractmethod
+    def stream(self, ingredients):
+        """Возвращает итератор байтовых кусков файла."""
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for name, amount, unit in ingredients:
+            yield f'{name}: {amount} {unit}\n'.encode(self.charset)
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_HEADER).encode(self.charset)
+        for row in ingredients:
+            yield writer.writerow(row).encode(self.charset)
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+
+    def stream(self, ingredients):
+        # PDF нельзя отдавать по частям до записи таблицы ссылок,
+        # поэтому документ собирается целиком и отдаётся одним чанком.
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_FONT)
+            )
+        buffer = io.BytesIO()
+        page = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        line_height = self.font_size * 1.5
+        y = height - self.margin
+        page.setFont(self.font_name, self.font_size)
+        page.drawString(self.margin, y, 'Список покупок')
+        y -= line_height * 2
+        for name, amount, unit in ingredients:
+            if y < self.margin:
+                page.showPage()
+                page.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            page.drawString(self.margin, y, f'{name}: {amount} {unit}')
+            y -= line_height
+        page.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
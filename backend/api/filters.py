@@ -1,8 +1,27 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db.models import Exists, F, OuterRef
+from django.utils.functional import cached_property
 from django_filters.rest_framework import FilterSet, filters
 
+from recipes.cache_versions import get_version
 from recipes.models import Recipe, Tag
 from users.models import User
 
+# Должна совпадать с конфигурацией в триггере recipes_recipe_search_vector.
+SEARCH_CONFIG = 'russian'
+
+
+def get_tag_ids():
+    """Словарь {slug: id} всех тегов из общего кеша, сбрасывается вместе
+    с версией tags."""
+    key = f'tag_ids_{get_version("tags")}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids)
+    return tag_ids
+
 
 class RecipeFilter(FilterSet):
     is_favorited = filters.BooleanFilter(
@@ -11,14 +30,18 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        to_field_name='slug',
-        field_name='tags__slug',
-        queryset=Tag.objects.all(),
-    )
+    tags = filters.MultipleChoiceFilter(method='get_tags')
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all()
     )
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(
+        choices=(
+            ('popular', 'По популярности'),
+            ('trending', 'Популярные сейчас'),
+        ),
+        method='get_ordering',
+    )
 
     class Meta:
         model = Recipe
@@ -27,8 +50,28 @@ class RecipeFilter(FilterSet):
             'is_in_shopping_cart',
             'tags',
             'author',
+            'search',
+            'ordering',
         )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filters['tags'].extra['choices'] = lambda: [
+            (slug, slug) for slug in self.tag_ids
+        ]
+
+    @cached_property
+    def tag_ids(self):
+        # Допустимые slug и их id берутся из одного снимка: версия тегов
+        # может смениться между проверкой значения и фильтрацией.
+        return get_tag_ids()
+
+    def get_tags(self, queryset, name, value):
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'),
+            tag_id__in=[self.tag_ids[slug] for slug in value],
+        )))
+
     def get_is_favorited(self, queryset, name, value):
         if value:
             return queryset.filter(favorites__user=self.request.user)
@@ -38,3 +81,18 @@ class RecipeFilter(FilterSet):
         if value:
             return queryset.filter(cart__user=self.request.user)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-id')
+
+    def get_ordering(self, queryset, name, value):
+        # Строка рейтинга есть у каждого рецепта, а INNER JOIN позволяет
+        # читать рецепты в порядке индекса рейтинга без сортировки.
+        return queryset.filter(score__isnull=False).order_by(
+            F(f'score__{value}').desc(nulls_last=True), '-id'
+        )
@@ -0,0 +1,100 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import (IngredientSerializer, RecipeSerializer,
+                             RecipeSnapshotSerializer, TagSerializer,
+                             UserSerializer, build_recipe_snapshots)
+from recipes.models import Ingredient, Recipe, Tag
+
+
+class ModelTagSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = '__all__'
+
+
+class ModelIngredientSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Ingredient
+        fields = '__all__'
+
+
+class ModelRecipeSerializer(serializers.ModelSerializer):
+    """Снимок рецепта на полях DRF - для сравнения."""
+    tags = ModelTagSerializer(many=True, read_only=True)
+    author = UserSerializer(read_only=True)
+    ingredients = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Recipe
+        exclude = ('search_vector', 'ingredient_ids', 'fanned_out',
+                   'favorites_count', 'cart_count')
+
+    def get_ingredients(self, obj):
+        return [
+            {
+                'id': item.ingredient.id,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in obj.recipe_ingredients.all()
+        ]
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость сериализаторов и JSON-рендереров на '
+            'рецептах, тегах и ингредиентах из базы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def measure(self, label, serialize, count, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            serialize()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{label}: {count * repeat / elapsed:.0f} объектов в секунду'
+        )
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        recipes = list(Recipe.objects.order_by('-id')[:options['recipes']])
+        build_recipe_snapshots(recipes)
+        # Первый проход кладёт снимки в кеш.
+        data = RecipeSerializer(recipes, many=True).data
+        tags = list(Tag.objects.all())
+        ingredients = list(Ingredient.objects.all())
+        cases = (
+            ('Рецепты, ModelSerializer', ModelRecipeSerializer, recipes),
+            ('Рецепты, снимок', RecipeSnapshotSerializer, recipes),
+            ('Рецепты, снимок из кеша', RecipeSerializer, recipes),
+            ('Теги, ModelSerializer', ModelTagSerializer, tags),
+            ('Теги', TagSerializer, tags),
+            ('Ингредиенты, ModelSerializer', ModelIngredientSerializer,
+             ingredients),
+            ('Ингредиенты', IngredientSerializer, ingredients),
+        )
+        for label, serializer_class, objects in cases:
+            self.measure(
+                label,
+                lambda: serializer_class(objects, many=True).data,
+                len(objects),
+                repeat,
+            )
+        renderers = [JSONRenderer()]
+        if orjson is not None:
+            renderers.append(FastJSONRenderer())
+        for renderer in renderers:
+            self.measure(
+                f'Рецепты, {type(renderer).__name__}',
+                lambda: renderer.render(data),
+                len(recipes),
+                repeat,
+            )
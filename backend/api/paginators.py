@@ -1,5 +1,33 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = "limit"
+
+
+class CursorLimitPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    ordering = '-id'
+
+
+class PageOrCursorPagination(BasePagination):
+    """Постраничная пагинация page/limit или, если в запросе передан
+    параметр cursor (для первой страницы пустой), пагинация по ключу
+    без COUNT и OFFSET. Пагинация по ключу работает только с сортировкой
+    по умолчанию, поэтому при ordering или search не применяется."""
+
+    custom_ordering_params = ('ordering', 'search')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (CursorLimitPagination.cursor_query_param in params
+                and not any(param in params
+                            for param in self.custom_ordering_params)):
+            self.paginator = CursorLimitPagination()
+        else:
+            self.paginator = PageLimitPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
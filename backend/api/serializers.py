@@ -1,40 +1,76 @@
-from django.core.exceptions import ValidationError
-from django.db.models import F
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Manager, Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 from rest_framework.validators import UniqueTogetherValidator
 
+from api.cache import (get_recipe_snapshot_keys, get_recipe_snapshots,
+                       set_recipe_snapshots)
+from api.utils import get_expand, get_recipes_limit
+from api.viewer_state import get_viewer_state
 from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
 from users.models import Subscription, User
 
 
-class TagSerializer(serializers.ModelSerializer):
+class ReadOnlySerializer(serializers.BaseSerializer):
+    """Сериализатор для чтения без полей DRF: значения атрибутов из
+    Meta.fields попадают в ответ как есть."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(*args, **kwargs)
+
+    def to_representation(self, instance):
+        return {name: getattr(instance, name) for name in self.Meta.fields}
+
+
+class TagSerializer(ReadOnlySerializer):
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(read_only=True)
-
+class IngredientSerializer(ReadOnlySerializer):
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии изображения рецепта.
+
+    Пока копии не готовы, отдаётся пустой словарь и клиенту следует
+    показывать оригинал из поля image.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        urls = {}
+        for name, path in variants.items():
+            url = default_storage.url(path)
+            urls[name] = request.build_absolute_uri(url) if request else url
+        return urls
 
 
 class ShortRecipeSerializer(ModelSerializer):
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = "id", "name", "image", "cooking_time"
+        fields = "id", "name", "image", "image_variants", "cooking_time"
         read_only_fields = ("__all__",)
 
 
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
-    recipes = ShortRecipeSerializer(many=True, read_only=True)
-    recipes_count = SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -45,18 +81,40 @@ class UserSerializer(serializers.ModelSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
-            'recipes',
             'recipes_count',
         )
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.expand_recipes():
+            fields['recipes'] = SerializerMethodField()
+        return fields
+
+    def expand_recipes(self):
+        # Список рецептов отдаётся только по запросу и только
+        # пользователям верхнего уровня, но не вложенным авторам.
+        request = self.context.get('request')
+        is_top_level = self.parent is None or (
+            self.parent is self.root
+            and isinstance(self.parent, serializers.ListSerializer)
+        )
+        if request is None or not is_top_level:
+            return False
+        return 'recipes' in get_expand(request)
+
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if not user.is_anonymous:
-            return user.subscriptions.filter(author=obj).exists()
-        return False
+        return get_viewer_state(self.context.get('request')).is_subscribed(
+            obj
+        )
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    def get_recipes(self, obj):
+        queryset = obj.recipes.all()[
+            :get_recipes_limit(self.context['request'])
+        ]
+        serializer = ShortRecipeSerializer(
+            queryset, many=True, context=self.context
+        )
+        return serializer.data
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
@@ -74,35 +132,128 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeSerializer(serializers.ModelSerializer):
-    tags = TagSerializer(many=True, read_only=True)
-    author = UserSerializer(read_only=True)
-    ingredients = SerializerMethodField()
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+RECIPE_SNAPSHOT_PREFETCH = (
+    'author',
+    'tags',
+    Prefetch(
+        'recipe_ingredients',
+        queryset=IngredientRecipe.objects.select_related('ingredient')
+    ),
+)
+
+
+class RecipeSnapshotSerializer(ReadOnlySerializer):
+    """Общая для всех пользователей часть рецепта.
+
+    Строится без запроса: ссылки на изображения остаются относительными,
+    is_subscribed автора - False.
+    """
+    author_fields = UserSerializer.Meta.fields
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        fields = ('name', 'image', 'text', 'cooking_time')
+
+    def to_representation(self, recipe):
+        tag_fields = TagSerializer.Meta.fields
+        data = {
+            'id': recipe.id,
+            'tags': [
+                {name: getattr(tag, name) for name in tag_fields}
+                for tag in recipe.tags.all()
+            ],
+            'author': {
+                name: False if name == 'is_subscribed' else getattr(
+                    recipe.author, name
+                )
+                for name in self.author_fields
+            },
+            'ingredients': [
+                {
+                    'id': item.ingredient.id,
+                    'name': item.ingredient.name,
+                    'measurement_unit': item.ingredient.measurement_unit,
+                    'amount': item.amount,
+                }
+                for item in recipe.recipe_ingredients.all()
+            ],
+            'image_variants': {
+                name: default_storage.url(path)
+                for name, path in recipe.image_variants.items()
+            },
+        }
+        data.update(super().to_representation(recipe))
+        data['image'] = recipe.image.url if recipe.image else None
+        return data
 
-    def get_ingredients(self, obj):
-        return obj.ingredients.all().values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('recipe_ingredients__amount')
-        )
 
-    def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.favorites.filter(recipe=obj).exists()
+def build_recipe_snapshots(recipes):
+    prefetch_related_objects(recipes, *RECIPE_SNAPSHOT_PREFETCH)
+    serializer = RecipeSnapshotSerializer()
+    return {
+        recipe.pk: serializer.to_representation(recipe) for recipe in recipes
+    }
+
+
+def refresh_recipe_snapshots(recipe_ids):
+    # Версии читаются до загрузки рецептов: если рецепт изменят
+    # в промежутке, снимок попадёт под уже устаревший ключ.
+    keys = get_recipe_snapshot_keys(recipe_ids)
+    recipes = list(Recipe.objects.filter(pk__in=recipe_ids))
+    set_recipe_snapshots(keys, build_recipe_snapshots(recipes))
+
+
+class RecipeListSerializer(serializers.ListSerializer):
 
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and user.cart.filter(recipe=obj).exists())
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, Manager) else data
+        return self.child.to_representations(list(recipes))
+
+
+class RecipeSerializer(RecipeSnapshotSerializer):
+    """Рецепт собирается из снимка в кеше и флагов текущего пользователя.
+
+    Снимок сбрасывается вместе с версией рецепта (api.cache), поэтому
+    при попадании в кеш теги, ингредиенты и автор не загружаются.
+    """
+    store_snapshots = True
+
+    class Meta(RecipeSnapshotSerializer.Meta):
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        return self.to_representations([instance])[0]
+
+    def to_representations(self, recipes):
+        keys = get_recipe_snapshot_keys([recipe.pk for recipe in recipes])
+        snapshots = get_recipe_snapshots(keys)
+        missing = [recipe for recipe in recipes if recipe.pk not in snapshots]
+        if missing:
+            built = build_recipe_snapshots(missing)
+            if self.store_snapshots:
+                set_recipe_snapshots(keys, built)
+            snapshots.update(built)
+        return [
+            self.complete_snapshot(recipe, snapshots[recipe.pk])
+            for recipe in recipes
+        ]
+
+    def complete_snapshot(self, recipe, data):
+        request = self.context.get('request')
+        viewer_state = get_viewer_state(request)
+        if request is not None:
+            if data['image']:
+                data['image'] = request.build_absolute_uri(data['image'])
+            data['image_variants'] = {
+                name: request.build_absolute_uri(url)
+                for name, url in data['image_variants'].items()
+            }
+        data['is_favorited'] = viewer_state.is_favorited(recipe)
+        data['is_in_shopping_cart'] = viewer_state.is_in_shopping_cart(recipe)
+        data['author']['is_subscribed'] = (
+            recipe.author_id in viewer_state.get_ids('subscriptions')
+        )
+        return data
 
 
 class IngredientCreateSerializer(serializers.ModelSerializer):
@@ -116,64 +267,126 @@ class IngredientCreateSerializer(serializers.ModelSerializer):
         )
 
 
+class IngredientAmountSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
+
+
 class RecipeCreateSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    ingredients = IngredientAmountSerializer(many=True, write_only=True)
 
     class Meta:
         model = Recipe
         fields = (
             'tags',
+            'ingredients',
             'name',
             'text',
             'cooking_time',
             'image',
         )
 
+    @transaction.atomic
     def create(self, validated_data):
-        tags = validated_data.pop('tags', None)
-        ingredients = validated_data.pop('ingredients', None)
-        self.validate_tags_and_ingredients(tags, ingredients)
+        tags = validated_data.pop('tags')
+        ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_ingredient_recipe_entries(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
-
-        if tags:
+        # Пишутся только переданные поля: остальные колонки (счётчики,
+        # image_variants) могли измениться, пока запрос выполнялся.
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if validated_data:
+            instance.save(update_fields=validated_data)
+
+        if tags is not None:
             instance.tags.set(tags)
 
-        if ingredients:
-            instance.ingredients.clear()
-            self.create_ingredient_recipe_entries(instance, ingredients)
+        if ingredients is not None:
+            self.update_ingredient_recipe_entries(instance, ingredients)
 
         return instance
 
-    def validate(self, attrs):
-        ingredients = self.initial_data.get('ingredients')
-        attrs.update({"ingredients": ingredients})
-        return super().validate(attrs)
-
-    def validate_tags_and_ingredients(self, tags, ingredients):
+    def validate_tags(self, tags):
         if not tags:
-            raise ValidationError('Выберите хотя бы один тег')
+            raise serializers.ValidationError('Выберите хотя бы один тег')
+        return tags
+
+    def validate_ingredients(self, ingredients):
         if not ingredients:
-            raise ValidationError('Укажите хотя бы один ингредиент')
+            raise serializers.ValidationError(
+                'Укажите хотя бы один ингредиент'
+            )
+        ids = [ingredient['id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться'
+            )
+        existing = set(
+            Ingredient.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        missing = [pk for pk in ids if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиентов с id {missing} не существует'
+            )
+        return ingredients
 
     def create_ingredient_recipe_entries(self, recipe, ingredients):
         IngredientRecipe.objects.bulk_create([
-            IngredientRecipe(ingredient_id=ingredient.get('id'),
-                             recipe=recipe, amount=ingredient.get('amount'))
+            IngredientRecipe(ingredient_id=ingredient['id'],
+                             recipe=recipe, amount=ingredient['amount'])
+            for ingredient in ingredients
+        ])
+
+    def update_ingredient_recipe_entries(self, recipe, ingredients):
+        amounts = {
+            ingredient['id']: ingredient['amount']
             for ingredient in ingredients
+        }
+        to_update = []
+        to_delete = []
+        kept = set()
+        for entry in recipe.recipe_ingredients.all():
+            if entry.ingredient_id not in amounts or (
+                    entry.ingredient_id in kept):
+                to_delete.append(entry.pk)
+                continue
+            kept.add(entry.ingredient_id)
+            if entry.amount != amounts[entry.ingredient_id]:
+                entry.amount = amounts[entry.ingredient_id]
+                to_update.append(entry)
+        if to_delete:
+            IngredientRecipe.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ('amount',))
+        self.create_ingredient_recipe_entries(recipe, [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in kept
         ])
 
     def to_representation(self, instance):
-        serializer = RecipeSerializer(instance, context=self.context)
+        serializer = RecipeWriteResultSerializer(
+            instance, context=self.context
+        )
         return serializer.data
 
 
+class RecipeWriteResultSerializer(RecipeSerializer):
+    # Объект после сохранения может отставать от базы (счётчики автора,
+    # уменьшенные копии изображения), поэтому снимок из него не кешируется:
+    # свежий снимок сохраняет refresh_recipe_snapshots после коммита.
+    store_snapshots = False
+
+
 class SubscriptonSerializer(serializers.ModelSerializer):
     email = serializers.ReadOnlyField(source='author.email')
     id = serializers.ReadOnlyField(source='author.id')
@@ -182,7 +395,7 @@ class SubscriptonSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
     recipes = RecipeSerializer(many=True, source='author.recipe_set')
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
 
     class Meta:
         model = Subscription
@@ -209,9 +422,6 @@ class SubscriptonSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Нельзя подписаться на себя')
         return data
 
-    def get_recipes_count(self, obj):
-        return obj.author.recipe_set.count()
-
 
 class RecipeFavoriteSerializer(serializers.ModelSerializer):
     class Meta:
@@ -225,21 +435,9 @@ class RecipeFavoriteSerializer(serializers.ModelSerializer):
 
 
 class SubscriptionReadSerializer(UserSerializer):
-    recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField(read_only=True)
-
-    class Meta(UserSerializer.Meta):
-        fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
-    def get_recipes(self, obj):
-        recipe_limit = self.context['request'].query_params.get(
-            "recipe_limit", 3)
-        queryset = obj.recipes.all()[:int(recipe_limit)]
-        serializer = RecipeFavoriteSerializer(queryset, many=True)
-        return serializer.data
+    def expand_recipes(self):
+        return True
 
 
 class FavoriteOrCartSerializer(serializers.ModelSerializer):
@@ -249,3 +447,29 @@ class FavoriteOrCartSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
+
+
+class BatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE,
+    )
+
+
+class IngredientMatchQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE,
+    )
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class RecipeMatchSerializer(RecipeSerializer):
+
+    def complete_snapshot(self, recipe, data):
+        data = super().complete_snapshot(recipe, data)
+        data['matched_count'] = recipe.matched_count
+        data['match_ratio'] = recipe.match_ratio
+        return data
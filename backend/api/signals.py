@@ -0,0 +1,52 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from api.cache import invalidate_recipes
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from users.models import User
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(instance, created=True, **kwargs):
+    # В карточке рецепта есть число рецептов автора, а оно меняется только
+    # при создании и удалении (post_delete не передаёт created), поэтому
+    # только тогда сбрасываются все рецепты этого автора.
+    if not created:
+        invalidate_recipes([instance.pk])
+        return
+    invalidate_recipes({instance.pk, *Recipe.objects.filter(
+        author_id=instance.author_id
+    ).values_list('id', flat=True)})
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def invalidate_recipe_ingredient(instance, **kwargs):
+    invalidate_recipes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        invalidate_recipes(instance.recipe_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_recipes(pk_set if reverse else [instance.pk])
+
+
+@receiver((post_save, pre_delete), sender=Tag)
+def invalidate_tag_recipes(instance, **kwargs):
+    invalidate_recipes(instance.recipe_set.values_list('id', flat=True))
+
+
+@receiver((post_save, pre_delete), sender=Ingredient)
+def invalidate_ingredient_recipes(instance, **kwargs):
+    invalidate_recipes(instance.recipe_ingredients.values_list(
+        'recipe_id', flat=True
+    ))
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(instance, update_fields, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    invalidate_recipes(instance.recipes.values_list('id', flat=True))
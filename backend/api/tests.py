@@ -0,0 +1,1040 @@
+import io
+import os
+import posixpath
+import random
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from api.renderers import FastJSONRenderer
+from api.serializers import RecipeCreateSerializer
+from recipes.cache_versions import get_versions
+from recipes.memberships import add_memberships, remove_memberships
+from recipes.models import (Favorite, FeedItem, Ingredient, IngredientRecipe,
+                            Recipe, RecipeScore, ShoppingCart, Tag)
+from recipes.recipe_match_index import recipe_match_index
+from recipes.scores import refresh_scores
+from users.models import Subscription, User
+
+# Картинка 1x1 в формате PNG.
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+
+def create_user(number):
+    return User.objects.create_user(
+        email=f'user{number}@example.com',
+        username=f'user{number}',
+        first_name='Имя',
+        last_name='Фамилия',
+        password='password',
+    )
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    data = {
+        'text': 'строка\u2028и\u2029"кавычки"\\',
+        'lazy': gettext_lazy('Тег'),
+        'empty': None,
+        'numbers': [1, -2, 0.5, 10 ** 18, Decimal('1.50'), True, False],
+        'nested': {'list': [], 'dict': {}, 1: 'ключ-число'},
+    }
+
+    def render(self, renderer, accepted_media_type=None, data=data):
+        return renderer.render(data, accepted_media_type, {})
+
+    def test_output_matches_drf_renderer(self):
+        for data in (self.data, [self.data, None], None, 'строка'):
+            with self.subTest(data=data):
+                self.assertEqual(
+                    self.render(FastJSONRenderer(), data=data),
+                    self.render(JSONRenderer(), data=data)
+                )
+
+    def test_fallbacks(self):
+        media_type = 'application/json; indent=4'
+        self.assertEqual(
+            self.render(FastJSONRenderer(), media_type),
+            self.render(JSONRenderer(), media_type)
+        )
+        with mock.patch('api.renderers.orjson', None):
+            self.assertEqual(
+                self.render(FastJSONRenderer()),
+                self.render(JSONRenderer())
+            )
+
+
+class FoodgramTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(number) for number in range(4)]
+        cls.user = cls.users[0]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(60)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def create_recipes(self, count, author=None, ingredients=3):
+        recipes = []
+        for number in range(count):
+            recipe = Recipe.objects.create(
+                author=author or self.users[number % len(self.users)],
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image='recipes/images/recipe.png',
+            )
+            recipe.tags.set(self.tags[:2])
+            IngredientRecipe.objects.bulk_create([
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in self.ingredients[:ingredients]
+            ])
+            recipes.append(recipe)
+        return recipes
+
+
+class RecipeQueryCountTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Subscription.objects.create(user=self.user, author=self.users[1])
+        recipe = self.create_recipes(1)[0]
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def assert_constant_queries(self, get_url, queries, authenticated):
+        if authenticated:
+            self.client.force_authenticate(self.user)
+        for count in (2, 10, 30):
+            self.create_recipes(count - Recipe.objects.count())
+            url = get_url()
+            cache.clear()
+            with self.subTest(recipes=count), self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_recipe_list_anonymous(self):
+        self.assert_constant_queries(
+            lambda: '/api/recipes/?limit=100', 5, authenticated=False
+        )
+
+    def test_recipe_list_authenticated(self):
+        self.assert_constant_queries(
+            lambda: '/api/recipes/?limit=100', 8, authenticated=True
+        )
+
+    def test_recipe_detail_anonymous(self):
+        self.assert_constant_queries(
+            lambda: f'/api/recipes/{Recipe.objects.latest("id").id}/', 4,
+            authenticated=False
+        )
+
+    def test_recipe_detail_authenticated(self):
+        self.assert_constant_queries(
+            lambda: f'/api/recipes/{Recipe.objects.latest("id").id}/', 7,
+            authenticated=True
+        )
+
+    def test_flags_are_not_cached_in_process_memory(self):
+        recipe = self.create_recipes(1)[0]
+        self.client.force_authenticate(self.user)
+        url = f'/api/recipes/{recipe.id}/'
+        self.assertFalse(self.client.get(url).data['is_favorited'])
+        # Запись из другого процесса: кеш этого процесса о ней не узнает.
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        self.assertTrue(self.client.get(url).data['is_favorited'])
+
+    def test_recipe_list_flags(self):
+        self.create_recipes(3)
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/recipes/')
+        results = response.data['results']
+        self.assertEqual(
+            {item['id'] for item in results if item['is_favorited']},
+            set(self.user.favorites.values_list('recipe_id', flat=True))
+        )
+        self.assertEqual(
+            {item['author']['id'] for item in results
+             if item['author']['is_subscribed']},
+            {self.users[1].id}
+        )
+
+
+class ShoppingCartDownloadTests(FoodgramTestCase):
+
+    def test_download_queries_do_not_depend_on_cart_size(self):
+        self.client.force_authenticate(self.user)
+        for count in (1, 5, 20):
+            for recipe in self.create_recipes(
+                    count - self.user.cart.count(), ingredients=10):
+                ShoppingCart.objects.create(user=self.user, recipe=recipe)
+            with self.subTest(recipes=count), self.assertNumQueries(1):
+                response = self.client.get(
+                    '/api/recipes/download_shopping_cart/'
+                )
+                content = b''.join(response.streaming_content)
+            self.assertIn(
+                f'Ингредиент 0: {count * 10} г'.encode(), content
+            )
+
+    def test_errors_are_rendered_as_json(self):
+        for url in ('/api/recipes/download_shopping_cart/',
+                    '/api/recipes/download_shopping_cart/?format=csv'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('detail', response.json())
+        self.client.force_authenticate(self.user)
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_ACCEPT='application/xml'
+        )
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class SubscriptionsQueryCountTests(FoodgramTestCase):
+
+    def test_subscriptions_queries_and_recipes_limit(self):
+        self.client.force_authenticate(self.user)
+        for count in (1, 3):
+            for author in self.users[1:count + 1]:
+                if not Subscription.objects.filter(
+                        user=self.user, author=author).exists():
+                    Subscription.objects.create(user=self.user, author=author)
+                    self.create_recipes(5, author=author)
+            cache.clear()
+            with self.subTest(authors=count), self.assertNumQueries(6):
+                response = self.client.get(
+                    '/api/users/subscriptions/?recipes_limit=2'
+                )
+            self.assertEqual(response.status_code, 200)
+            results = response.data['results']
+            self.assertEqual(len(results), count)
+            for author in results:
+                self.assertEqual(author['recipes_count'], 5)
+                self.assertEqual(len(author['recipes']), 2)
+                self.assertTrue(author['is_subscribed'])
+
+    def test_default_recipes_limit(self):
+        Subscription.objects.create(user=self.user, author=self.users[1])
+        self.create_recipes(5, author=self.users[1])
+        self.client.force_authenticate(self.user)
+        for url in ('/api/users/subscriptions/',
+                    '/api/users/subscriptions/?recipes_limit=-1'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(
+                    len(response.data['results'][0]['recipes']),
+                    settings.RECIPES_LIMIT_DEFAULT
+                )
+
+
+class IngredientSearchTests(FoodgramTestCase):
+
+    def test_index_matches_database_order(self):
+        Ingredient.objects.bulk_create([
+            Ingredient(name=name, measurement_unit='г')
+            for name in (
+                'Ёжевика', 'ежевика', 'Ель', 'еда', 'Яблоко', 'ябло',
+                'apple', 'Apple', 'сок яблочный', 'Сок', 'морс ежевичный',
+                'Ежевичный джем', 'ёлка', 'Е-добавка', 'е 2',
+            )
+        ])
+        for name in ('е', 'ё', 'я', 'сок', 'a', 'ежевич', 'ингредиент 1'):
+            url = f'/api/ingredients/?name={name}'
+            with self.subTest(name=name):
+                with self.settings(INGREDIENT_INDEX_ENABLED=False):
+                    expected = self.client.get(url).json()
+                cache.clear()
+                with self.settings(INGREDIENT_INDEX_ENABLED=True):
+                    self.assertEqual(self.client.get(url).json(), expected)
+                cache.clear()
+
+
+class ReferenceCacheTests(FoodgramTestCase):
+
+    def assert_conditional_get(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('public', response['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_tags(self):
+        tag = self.tags[0]
+
+        def change():
+            tag.name = 'Новый тег'
+            tag.save()
+
+        for url in ('/api/tags/', f'/api/tags/{tag.id}/'):
+            with self.subTest(url=url):
+                self.assert_conditional_get(url, change)
+
+    def test_ingredients(self):
+        ingredient = self.ingredients[0]
+
+        def change():
+            ingredient.name = 'Новый ингредиент'
+            ingredient.save()
+
+        for url in ('/api/ingredients/', '/api/ingredients/?name=ингр',
+                    f'/api/ingredients/{ingredient.id}/'):
+            with self.subTest(url=url):
+                self.assert_conditional_get(url, change)
+
+
+class RecipeTagFilterTests(FoodgramTestCase):
+
+    def test_tag_removed_during_request(self):
+        recipe = self.create_recipes(1)[0]
+        tag_ids = {tag.slug: tag.id for tag in self.tags}
+        # Второе чтение видит уже новую версию тегов без tag0.
+        with mock.patch('api.filters.get_tag_ids', side_effect=[
+            tag_ids, {'tag1': tag_ids['tag1'], 'tag2': tag_ids['tag2']},
+        ]):
+            response = self.client.get('/api/recipes/', {'tags': 'tag0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['id'] for item in response.data['results']], [recipe.id]
+        )
+
+
+class PaginationTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = self.create_recipes(5)
+        self.client.force_authenticate(self.user)
+
+    def get_page(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [
+            query['sql'].upper() for query in context.captured_queries
+        ]
+
+    def test_cursor_skips_count_and_offset(self):
+        data, queries = self.get_page('/api/recipes/?cursor=&limit=2')
+        self.assertNotIn('count', data)
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']],
+            [recipe.id for recipe in self.recipes[:2:-1]]
+        )
+        for sql in queries:
+            self.assertNotIn('COUNT(', sql)
+            self.assertNotIn('OFFSET', sql)
+
+    def test_ordering_and_search_use_page_numbers(self):
+        for params in ('ordering=popular', 'search=Рецепт'):
+            with self.subTest(params=params):
+                data, _ = self.get_page(
+                    f'/api/recipes/?cursor=&limit=2&{params}'
+                )
+                self.assertEqual(data['count'], 5)
+                self.assertEqual(len(data['results']), 2)
+
+    def test_cursor_pages_are_stable_across_inserts(self):
+        data, _ = self.get_page('/api/recipes/?cursor=&limit=2')
+        seen = [recipe['id'] for recipe in data['results']]
+        self.create_recipes(2)
+        while data['next']:
+            data, _ = self.get_page(data['next'])
+            seen += [recipe['id'] for recipe in data['results']]
+        self.assertEqual(seen, [recipe.id for recipe in self.recipes[::-1]])
+
+
+class RecipeCacheTests(FoodgramTestCase):
+
+    def test_detail_cache_is_invalidated_for_any_pk_spelling(self):
+        recipe = self.create_recipes(1)[0]
+        for url in (f'/api/recipes/0{recipe.id}/',
+                    f'/api/recipes/{recipe.id}/'):
+            self.assertEqual(self.client.get(url).data['name'], recipe.name)
+        recipe.name = 'Новое название'
+        recipe.save()
+        for url in (f'/api/recipes/0{recipe.id}/',
+                    f'/api/recipes/{recipe.id}/'):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.client.get(url).data['name'], 'Новое название'
+                )
+
+    def test_author_recipes_are_invalidated_only_on_create_and_delete(self):
+        recipes = self.create_recipes(3, author=self.user)
+        names = [f'recipe_{recipe.id}' for recipe in recipes]
+        versions = get_versions(names)
+        recipes[0].name = 'Новое название'
+        recipes[0].save()
+        changed = get_versions(names)
+        self.assertNotEqual(changed[names[0]], versions[names[0]])
+        self.assertEqual(
+            [changed[name] for name in names[1:]],
+            [versions[name] for name in names[1:]]
+        )
+        for change in (lambda: self.create_recipes(1, author=self.user),
+                       recipes[0].delete):
+            versions = get_versions(names[1:])
+            change()
+            changed = get_versions(names[1:])
+            for name in names[1:]:
+                self.assertNotEqual(changed[name], versions[name])
+
+    def test_memberships_keep_recipe_caches(self):
+        recipe = self.create_recipes(1)[0]
+        names = ['recipe_lists', f'recipe_{recipe.id}']
+        versions = get_versions(names)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_memberships(Favorite, self.user, [recipe.id])
+            ShoppingCart.objects.create(user=self.users[1], recipe=recipe)
+            remove_memberships(Favorite, self.user, [recipe.id])
+        self.assertEqual(get_versions(names), versions)
+        for data in (self.client.get(f'/api/recipes/{recipe.id}/').data,
+                     self.client.get('/api/recipes/').data['results'][0]):
+            self.assertFalse({'favorites_count', 'cart_count'} & data.keys())
+
+    def test_list_cache_keys_are_valid_for_memcached(self):
+        self.create_recipes(2)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            response = self.client.get(
+                '/api/recipes/', {'tags': ['tag0 ' * 100, 'tag1']}
+            )
+        self.assertEqual(response.status_code, 400)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            response = self.client.get('/api/recipes/', {'author': 'a b'})
+        self.assertNotEqual(response.status_code, 500)
+
+
+class MediaStorageTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = Recipe._meta.get_field('image').storage
+
+    def post_recipe(self, name):
+        return self.client.post('/api/recipes/', {
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 10}],
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+        }, format='json')
+
+    def save_file(self, name, content, age_hours=0):
+        name = self.storage.save(name, ContentFile(content))
+        modified = time.time() - age_hours * 3600
+        os.utime(self.storage.path(name), (modified, modified))
+        return name
+
+    def test_identical_uploads_are_stored_once(self):
+        self.client.force_authenticate(self.user)
+        for name in ('Первый', 'Второй'):
+            self.assertEqual(self.post_recipe(name).status_code, 201)
+        images = set(Recipe.objects.values_list('image', flat=True))
+        self.assertEqual(len(images), 1)
+        _, files = self.storage.listdir(posixpath.dirname(images.pop()))
+        self.assertEqual(len(files), 1)
+        self.assertNotEqual(
+            self.storage.save('recipes/images/a.png', ContentFile(b'a')),
+            self.storage.save('recipes/images/b.png', ContentFile(b'b'))
+        )
+
+    def test_garbage_collection_removes_old_unreferenced_files(self):
+        recipe = self.create_recipes(1)[0]
+        image = self.save_file('recipes/images/used.png', b'used', 48)
+        variant = self.save_file('recipes/variants/used.webp', b'v', 48)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image=image, image_variants={'small': variant}
+        )
+        old = [
+            self.save_file('recipes/images/old.png', b'old', 48),
+            self.save_file('recipes/variants/old.webp', b'old v', 48),
+        ]
+        new = self.save_file('recipes/images/new.png', b'new', 1)
+        call_command(
+            'collect_media_garbage', min_age=24, dry_run=True,
+            stdout=io.StringIO()
+        )
+        for name in (image, variant, new, *old):
+            self.assertTrue(self.storage.exists(name))
+        call_command(
+            'collect_media_garbage', min_age=24, stdout=io.StringIO()
+        )
+        for name in (image, variant, new):
+            self.assertTrue(self.storage.exists(name))
+        for name in old:
+            self.assertFalse(self.storage.exists(name))
+
+
+class RecipeUpdateQueryCountTests(FoodgramTestCase):
+
+    def test_update_queries_do_not_depend_on_ingredient_count(self):
+        self.client.force_authenticate(self.user)
+        for count in (5, 20, 50):
+            recipe = self.create_recipes(
+                1, author=self.user, ingredients=count
+            )[0]
+            # Два ингредиента удаляются, два добавляются, у остальных
+            # меняется количество.
+            ingredients = [
+                {'id': ingredient.id, 'amount': 20}
+                for ingredient in self.ingredients[2:count + 2]
+            ]
+            cache.clear()
+            with self.subTest(ingredients=count), self.assertNumQueries(16):
+                response = self.client.patch(
+                    f'/api/recipes/{recipe.id}/',
+                    {'ingredients': ingredients, 'name': 'Новое название'},
+                    format='json',
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                sorted(
+                    (item['id'], item['amount'])
+                    for item in response.data['ingredients']
+                ),
+                sorted((item['id'], item['amount']) for item in ingredients)
+            )
+
+
+class CounterTests(FoodgramTestCase):
+
+    def test_save_keeps_concurrent_counter_changes(self):
+        recipe = self.create_recipes(1, author=self.users[1])[0]
+        stale_recipe = Recipe.objects.get(pk=recipe.pk)
+        stale_author = User.objects.get(pk=self.users[1].pk)
+        # Пока объекты загружены, другие запросы меняют счётчики.
+        add_memberships(Favorite, self.user, [recipe.pk])
+        add_memberships(ShoppingCart, self.user, [recipe.pk])
+        add_memberships(Subscription, self.user, [stale_author.pk])
+        stale_recipe.name = 'Новое название'
+        stale_recipe.save()
+        stale_author.set_password('new-password')
+        stale_author.save()
+        recipe.refresh_from_db()
+        author = User.objects.get(pk=stale_author.pk)
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(
+            (recipe.favorites_count, recipe.cart_count), (1, 1)
+        )
+        self.assertEqual(
+            (author.recipes_count, author.subscribers_count), (1, 1)
+        )
+        self.assertTrue(author.check_password('new-password'))
+
+
+class RecipeOrderingTests(FoodgramTestCase):
+
+    def test_ordering_keeps_recipes_without_computed_score(self):
+        recipes = self.create_recipes(3)
+        Favorite.objects.create(user=self.user, recipe=recipes[0])
+        refresh_scores(full=True)
+        # Рецепт, созданный после пересчёта, тоже попадает в выдачу.
+        new_recipe = self.create_recipes(1)[0]
+        for ordering in ('popular', 'trending'):
+            with self.subTest(ordering=ordering):
+                response = self.client.get(
+                    '/api/recipes/', {'ordering': ordering}
+                )
+                self.assertEqual(
+                    [item['id'] for item in response.data['results']],
+                    [recipes[0].id, new_recipe.id,
+                     recipes[2].id, recipes[1].id]
+                )
+
+    def get_ordered_ids(self, ordering):
+        response = self.client.get('/api/recipes/', {'ordering': ordering})
+        return [item['id'] for item in response.data['results']]
+
+    def test_incremental_refresh_sees_removals(self):
+        recipes = self.create_recipes(2)
+        add_memberships(Favorite, self.user, [recipes[0].id])
+        refresh_scores(full=True)
+        self.assertEqual(
+            self.get_ordered_ids('popular'), [recipes[0].id, recipes[1].id]
+        )
+        remove_memberships(Favorite, self.user, [recipes[0].id])
+        self.assertEqual(refresh_scores(), 1)
+        self.assertEqual(RecipeScore.objects.get(recipe=recipes[0]).popular, 0)
+        cache.clear()
+        self.assertEqual(
+            self.get_ordered_ids('popular'), [recipes[1].id, recipes[0].id]
+        )
+        self.assertEqual(refresh_scores(), 0)
+
+    def test_recipes_without_events_rank_last_in_trending(self):
+        old_recipe, new_recipe = self.create_recipes(2)
+        favorite = Favorite.objects.create(user=self.user, recipe=old_recipe)
+        Favorite.objects.filter(pk=favorite.pk).update(
+            created=datetime(2020, 1, 1, tzinfo=timezone.utc)
+        )
+        refresh_scores(full=True)
+        self.assertLess(
+            RecipeScore.objects.get(recipe=old_recipe).trending, 0
+        )
+        self.assertIsNone(RecipeScore.objects.get(recipe=new_recipe).trending)
+        self.assertEqual(
+            self.get_ordered_ids('trending'), [old_recipe.id, new_recipe.id]
+        )
+
+
+class MembershipEndpointTests(FoodgramTestCase):
+
+    def test_cannot_subscribe_to_yourself(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_non_numeric_ids_are_not_found(self):
+        self.client.force_authenticate(self.user)
+        for url in ('/api/users/abc/subscribe/',
+                    '/api/recipes/abc/favorite/',
+                    '/api/recipes/abc/shopping_cart/'):
+            for method in (self.client.post, self.client.delete):
+                with self.subTest(url=url, method=method.__name__):
+                    self.assertEqual(method(url).status_code, 404)
+
+
+class MembershipBatchTests(FoodgramTestCase):
+
+    def assert_statuses(self, response, statuses):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['id'], item['status']) for item in response.json()],
+            statuses
+        )
+
+    def test_recipe_batches(self):
+        first, second = self.create_recipes(2)
+        missing = second.id + 1
+        self.client.force_authenticate(self.user)
+        for url, model, counter in (
+                ('/api/recipes/favorite/batch/', Favorite, 'favorites_count'),
+                ('/api/recipes/shopping_cart/batch/', ShoppingCart,
+                 'cart_count')):
+            with self.subTest(url=url):
+                model.objects.create(user=self.user, recipe=first)
+                self.assert_statuses(
+                    self.client.post(url, {
+                        'ids': [first.id, second.id, missing, second.id]
+                    }, format='json'),
+                    [(first.id, 'exists'), (second.id, 'created'),
+                     (missing, 'not_found')]
+                )
+                self.assertEqual(
+                    model.objects.filter(user=self.user).count(), 2
+                )
+                self.assertEqual(
+                    Recipe.objects.filter(
+                        pk__in=(first.id, second.id)
+                    ).values_list(counter, flat=True).distinct().get(),
+                    1
+                )
+                self.assert_statuses(
+                    self.client.delete(url, {
+                        'ids': [second.id, missing, second.id]
+                    }, format='json'),
+                    [(second.id, 'deleted'), (missing, 'not_found')]
+                )
+                self.assertEqual(
+                    Recipe.objects.values_list(counter, flat=True).get(
+                        pk=second.id
+                    ),
+                    0
+                )
+                self.assert_statuses(
+                    self.client.delete(
+                        url, {'ids': [second.id]}, format='json'
+                    ),
+                    [(second.id, 'not_found')]
+                )
+
+    def test_subscribe_batch(self):
+        url = '/api/users/subscribe/batch/'
+        authors = self.users[1:3]
+        self.client.force_authenticate(self.user)
+        self.assert_statuses(
+            self.client.post(url, {
+                'ids': [self.user.id, authors[0].id, authors[1].id,
+                        authors[0].id]
+            }, format='json'),
+            [(self.user.id, 'not_found'), (authors[0].id, 'created'),
+             (authors[1].id, 'created')]
+        )
+        self.assertFalse(
+            Subscription.objects.filter(author=self.user).exists()
+        )
+        self.assertEqual(
+            list(User.objects.filter(
+                pk__in=[self.user.id, *(author.id for author in authors)]
+            ).order_by('id').values_list('subscribers_count', flat=True)),
+            [0, 1, 1]
+        )
+        self.assert_statuses(
+            self.client.delete(url, {
+                'ids': [authors[0].id, self.user.id]
+            }, format='json'),
+            [(authors[0].id, 'deleted'), (self.user.id, 'not_found')]
+        )
+        self.assertEqual(
+            User.objects.values_list('subscribers_count', flat=True).get(
+                pk=authors[0].id
+            ),
+            0
+        )
+
+    def test_batch_size_is_limited(self):
+        recipe = self.create_recipes(1)[0]
+        self.client.force_authenticate(self.user)
+        for url in ('/api/recipes/favorite/batch/',
+                    '/api/recipes/shopping_cart/batch/',
+                    '/api/users/subscribe/batch/'):
+            for method in (self.client.post, self.client.delete):
+                with self.subTest(url=url, method=method.__name__):
+                    response = method(url, {
+                        'ids': [recipe.id] * (settings.BATCH_MAX_SIZE + 1)
+                    }, format='json')
+                    self.assertEqual(response.status_code, 400)
+                    response = method(url, {'ids': []}, format='json')
+                    self.assertEqual(response.status_code, 400)
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(Subscription.objects.exists())
+
+
+class RecipeInternalFieldsTests(FoodgramTestCase):
+    # Служебные колонки Recipe, которые не должны попадать в ответы API.
+    internal_fields = {'search_vector', 'ingredient_ids', 'fanned_out'}
+
+    def assert_no_internal_fields(self, recipes):
+        self.assertTrue(recipes)
+        for recipe in recipes:
+            self.assertFalse(self.internal_fields & recipe.keys())
+
+    def test_recipe_list_and_detail(self):
+        recipe = self.create_recipes(1)[0]
+        self.assert_no_internal_fields(
+            self.client.get('/api/recipes/').json()['results']
+        )
+        self.assert_no_internal_fields(
+            [self.client.get(f'/api/recipes/{recipe.id}/').json()]
+        )
+
+    def test_recipes_by_ingredients(self):
+        self.client.force_authenticate(self.user)
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+                MEDIA_ROOT=media_root):
+            response = self.client.post('/api/recipes/', {
+                'tags': [self.tags[0].id],
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': 10}
+                    for ingredient in self.ingredients[:3]
+                ],
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': IMAGE,
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(name='Рецепт')
+        self.assertEqual(
+            sorted(recipe.ingredient_ids),
+            [ingredient.id for ingredient in self.ingredients[:3]]
+        )
+        for enabled in (False, True):
+            recipe_match_index.invalidate()
+            with self.subTest(index=enabled), self.settings(
+                    RECIPE_MATCH_INDEX_ENABLED=enabled):
+                response = self.client.get(
+                    '/api/recipes/by_ingredients/',
+                    {'ingredients': self.ingredients[0].id}
+                )
+                self.assertEqual(
+                    [item['id'] for item in response.json()], [recipe.id]
+                )
+                self.assert_no_internal_fields(response.json())
+
+    def test_feed(self):
+        Subscription.objects.create(user=self.user, author=self.users[1])
+        self.create_recipes(1, author=self.users[1])
+        self.client.force_authenticate(self.user)
+        self.assert_no_internal_fields(
+            self.client.get('/api/recipes/feed/').json()['results']
+        )
+
+
+class RecipeMatchTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        recipe_match_index.invalidate()
+
+    def tearDown(self):
+        recipe_match_index.invalidate()
+
+    def test_index_matches_database_order(self):
+        generator = random.Random(0)
+        ingredients = self.ingredients[:12]
+        for number in range(60):
+            recipe = Recipe.objects.create(
+                author=self.user,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image='recipes/images/recipe.png',
+            )
+            IngredientRecipe.objects.bulk_create([
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in generator.sample(
+                    ingredients, generator.randint(1, 6)
+                )
+            ])
+        for _ in range(20):
+            ingredient_ids = [
+                ingredient.id for ingredient in generator.sample(
+                    ingredients, generator.randint(1, 5)
+                )
+            ]
+            limit = generator.choice((5, 20, 100))
+            with self.subTest(ingredients=ingredient_ids, limit=limit):
+                expected = [
+                    (recipe.id, recipe.matched_count, recipe.match_ratio)
+                    for recipe in Recipe.objects.with_ingredients(
+                        ingredient_ids
+                    )[:limit]
+                ]
+                self.assertTrue(expected)
+                with self.settings(RECIPE_MATCH_INDEX_ENABLED=True):
+                    response = self.client.get(
+                        '/api/recipes/by_ingredients/',
+                        {'ingredients': ingredient_ids, 'limit': limit}
+                    )
+                self.assertEqual(response.status_code, 200)
+                actual = [
+                    (item['id'], item['matched_count'], item['match_ratio'])
+                    for item in response.json()
+                ]
+                self.assertEqual(len(actual), len(expected))
+                for item, expected_item in zip(actual, expected):
+                    self.assertEqual(item[:2], expected_item[:2])
+                    self.assertAlmostEqual(item[2], expected_item[2])
+
+
+class FeedTests(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.users[1]
+        self.client.force_authenticate(self.user)
+
+    def get_feed_ids(self):
+        response = self.client.get('/api/recipes/feed/?limit=100')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_new_recipe_is_fanned_out_to_subscribers(self):
+        Subscription.objects.create(user=self.user, author=self.author)
+        recipe = self.create_recipes(1, author=self.author)[0]
+        self.create_recipes(1, author=self.users[2])
+        self.assertTrue(Recipe.objects.get(pk=recipe.pk).fanned_out)
+        self.assertEqual(
+            list(FeedItem.objects.values_list('user_id', 'recipe_id')),
+            [(self.user.id, recipe.id)]
+        )
+        self.assertEqual(self.get_feed_ids(), [recipe.id])
+
+    def test_subscribe_backfills_recent_recipes(self):
+        recipes = self.create_recipes(3, author=self.author)
+        with self.settings(FEED_BACKFILL_SIZE=2):
+            response = self.client.post(
+                f'/api/users/{self.author.id}/subscribe/'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            self.get_feed_ids(), [recipe.id for recipe in recipes[:0:-1]]
+        )
+
+    def test_unsubscribe_removes_author_recipes(self):
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.client.post(f'/api/users/{self.users[2].id}/subscribe/')
+        self.create_recipes(2, author=self.author)
+        other = self.create_recipes(1, author=self.users[2])[0]
+        response = self.client.delete(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(
+            FeedItem.objects.filter(author=self.author).exists()
+        )
+        self.assertEqual(self.get_feed_ids(), [other.id])
+
+    def test_popular_author_recipes_are_read_on_request(self):
+        Subscription.objects.create(user=self.user, author=self.author)
+        fanned_out = self.create_recipes(1, author=self.author)[0]
+        self.author.refresh_from_db()
+        with self.settings(FEED_FANOUT_MAX_SUBSCRIBERS=0):
+            pending = self.create_recipes(1, author=self.author)[0]
+        self.assertFalse(Recipe.objects.get(pk=pending.pk).fanned_out)
+        self.assertFalse(FeedItem.objects.filter(recipe=pending).exists())
+        self.assertEqual(self.get_feed_ids(), [pending.id, fanned_out.id])
+        self.client.force_authenticate(self.users[2])
+        self.assertEqual(self.get_feed_ids(), [])
+
+
+class RecipeUpdateFieldsTests(FoodgramTestCase):
+
+    def test_update_keeps_columns_changed_concurrently(self):
+        recipe = self.create_recipes(1, author=self.user)[0]
+        stale_recipe = Recipe.objects.get(pk=recipe.pk)
+        add_memberships(Favorite, self.user, [recipe.pk])
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image_variants={'small': 'recipes/images/small.webp'}
+        )
+        serializer = RecipeCreateSerializer(
+            stale_recipe, data={'name': 'Новое название'}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(
+            recipe.image_variants, {'small': 'recipes/images/small.webp'}
+        )
+
+
+class ConcurrentMembershipTests(APITransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.author = create_user(0), create_user(1)
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipes/images/recipe.png',
+        )
+
+    def request_concurrently(self, *requests):
+        """Выполняет запросы (метод, url) одновременно из разных потоков
+        и возвращает коды ответов или исключения."""
+        barrier = threading.Barrier(len(requests))
+        results = [None] * len(requests)
+
+        def send(number, method, url):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                results[number] = getattr(client, method)(url).status_code
+            except Exception as error:
+                results[number] = error
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=send, args=(number, *request))
+            for number, request in enumerate(requests)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def assert_counter(self, model, obj, counter, rows):
+        obj.refresh_from_db()
+        self.assertEqual(model.objects.count(), rows)
+        self.assertEqual(getattr(obj, counter), rows)
+
+    def test_concurrent_adds_create_one_row(self):
+        for model, url, obj, counter in (
+            (Favorite, f'/api/recipes/{self.recipe.id}/favorite/',
+             self.recipe, 'favorites_count'),
+            (ShoppingCart, f'/api/recipes/{self.recipe.id}/shopping_cart/',
+             self.recipe, 'cart_count'),
+            (Subscription, f'/api/users/{self.author.id}/subscribe/',
+             self.author, 'subscribers_count'),
+        ):
+            with self.subTest(model=model.__name__):
+                results = self.request_concurrently(
+                    *[('post', url)] * self.threads
+                )
+                self.assertEqual(results.count(201), 1, results)
+                self.assertEqual(
+                    results.count(400), self.threads - 1, results
+                )
+                self.assert_counter(model, obj, counter, 1)
+
+    def test_concurrent_adds_and_removes_keep_counter(self):
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+        results = self.request_concurrently(
+            *[('post', url), ('delete', url)] * (self.threads // 2)
+        )
+        self.assertTrue(set(results) <= {201, 204, 400}, results)
+        self.assert_counter(
+            Favorite, self.recipe, 'favorites_count',
+            results.count(201) - results.count(204)
+        )
+        results = self.request_concurrently(
+            *[('post', url)] * self.threads
+        )
+        self.assertLessEqual(results.count(201), 1, results)
+        self.assertEqual(
+            results.count(400), self.threads - results.count(201), results
+        )
+        self.assert_counter(Favorite, self.recipe, 'favorites_count', 1)
@@ -1,18 +1,65 @@
-from django.shortcuts import get_object_or_404
+from datetime import datetime, timezone
 
-from users.models import Subscription
+from django.conf import settings
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.http import Http404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
+from recipes.cache_versions import get_version
+from recipes.models import Recipe
 
-def delete_object(request, pk, model_object, model_for_delete_object):
-    user = request.user
 
-    if model_for_delete_object is Subscription:
-        obj_for_delete = get_object_or_404(
-            model_for_delete_object, user=user, author=pk
-        )
-    else:
-        obj_for_delete = get_object_or_404(
-            model_for_delete_object, user=user, recipe=pk
+def reference_cache(name):
+    def get_etag(request, *args, **kwargs):
+        return f'{name}-{get_version(name)}'
+
+    def get_last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(
+            get_version(name) / 10 ** 9, tz=timezone.utc
         )
 
-    obj_for_delete.delete()
+    def decorator(view_func):
+        return cache_control(
+            public=True, max_age=settings.REFERENCE_CACHE_MAX_AGE
+        )(condition(
+            etag_func=get_etag, last_modified_func=get_last_modified
+        )(view_func))
+    return decorator
+
+
+def prefetch_recipes(queryset, request):
+    recipes = Recipe.objects.filter(id__in=Subquery(
+        Recipe.objects.filter(
+            author=OuterRef('author')
+        ).values('id')[:get_recipes_limit(request)]
+    ))
+    return queryset.prefetch_related(Prefetch('recipes', queryset=recipes))
+
+
+def get_users_queryset(queryset, request):
+    if 'recipes' in get_expand(request):
+        queryset = prefetch_recipes(queryset, request)
+    return queryset
+
+
+def get_expand(request):
+    return set(request.query_params.get('expand', '').split(','))
+
+
+def get_recipes_limit(request):
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return settings.RECIPES_LIMIT_DEFAULT
+    if recipes_limit < 0:
+        return settings.RECIPES_LIMIT_DEFAULT
+    return recipes_limit
+
+
+def get_pk(pk):
+    """id из URL проверяется до того, как попадёт в сырой SQL."""
+    try:
+        return int(pk)
+    except ValueError:
+        raise Http404
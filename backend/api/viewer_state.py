@@ -0,0 +1,38 @@
+from recipes.membership_cache import get_membership_ids
+
+
+class ViewerState:
+    """Избранное, корзина и подписки текущего пользователя.
+
+    Множества id берутся из общего кеша (при промахе - одним запросом на
+    каждое) при первом обращении и дальше используются всеми
+    сериализаторами этого запроса.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._ids = None
+
+    def get_ids(self, name):
+        if self.user is None or self.user.is_anonymous:
+            return frozenset()
+        if self._ids is None:
+            self._ids = get_membership_ids(self.user.pk)
+        return self._ids[name]
+
+    def is_favorited(self, recipe):
+        return recipe.pk in self.get_ids('favorites')
+
+    def is_in_shopping_cart(self, recipe):
+        return recipe.pk in self.get_ids('cart')
+
+    def is_subscribed(self, author):
+        return author.pk in self.get_ids('subscriptions')
+
+
+def get_viewer_state(request):
+    if request is None:
+        return ViewerState(None)
+    if not hasattr(request, 'viewer_state'):
+        request.viewer_state = ViewerState(request.user)
+    return request.viewer_state
@@ -1,29 +1,67 @@
-from django.http import HttpResponse
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django_filters import rest_framework as filters
 from djoser.views import UserViewSet as BaseUserViewSet
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import action
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.status import (HTTP_201_CREATED, HTTP_204_NO_CONTENT,
                                    HTTP_400_BAD_REQUEST)
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
+from api.cache import (get_cached_response, get_recipe_detail_cache_key,
+                       get_recipe_list_cache_key, invalidate_recipes)
+from api.exports import SHOPPING_LIST_RENDERERS, ShoppingListRenderer
 from api.filters import RecipeFilter
-from api.paginators import PageLimitPagination
+from api.paginators import PageOrCursorPagination
 from api.permissions import IsOwnerOrReadOnly
-from api.utils import delete_object
+from api.utils import (get_pk, get_users_queryset, prefetch_recipes,
+                       reference_cache)
+from recipes.feed import get_feed_queryset
+from recipes.images import schedule_image_processing
+from recipes.ingredient_index import ingredient_index
+from recipes.memberships import add_memberships, remove_memberships
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
                             ShoppingCart, Tag)
+from recipes.recipe_match_index import recipe_match_index
 from users.models import Subscription, User
 
-from .serializers import (FavoriteOrCartSerializer, IngredientSerializer,
+from .serializers import (BatchSerializer, FavoriteOrCartSerializer,
+                          IngredientMatchQuerySerializer, IngredientSerializer,
                           RecipeCreateSerializer, RecipeFavoriteSerializer,
-                          RecipeSerializer, SubscriptionReadSerializer,
-                          TagSerializer, UserSerializer)
+                          RecipeMatchSerializer, RecipeSerializer,
+                          SubscriptionReadSerializer, TagSerializer,
+                          UserSerializer, refresh_recipe_snapshots)
+
 
+def process_batch(request, model, queryset):
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = list(dict.fromkeys(serializer.validated_data['ids']))
+    if request.method == 'POST':
+        found = set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+        created = add_memberships(model, request.user, found)
+        statuses = {
+            pk: 'created' if pk in created else 'exists' for pk in found
+        }
+    else:
+        deleted = remove_memberships(model, request.user, ids)
+        statuses = dict.fromkeys(deleted, 'deleted')
+    return Response([
+        {'id': pk, 'status': statuses.get(pk, 'not_found')} for pk in ids
+    ])
 
+
+@method_decorator(reference_cache('tags'), name='list')
+@method_decorator(reference_cache('tags'), name='retrieve')
 class TagViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -31,31 +69,92 @@ class TagViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     pagination_class = None
 
 
+@method_decorator(reference_cache('ingredients'), name='list')
+@method_decorator(reference_cache('ingredients'), name='retrieve')
 class IngredientViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (permissions.AllowAny,)
     pagination_class = None
+    search_limit = 50
 
     def get_queryset(self):
         queryset = super().get_queryset()
         name = self.request.query_params.get('name')
-        if name is not None:
-            queryset = queryset.filter(name__icontains=name)
+        if name and self.action == 'list':
+            queryset = queryset.search(name)[:self.search_limit]
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        if not settings.INGREDIENT_INDEX_ENABLED:
+            return super().list(request, *args, **kwargs)
+        name = request.query_params.get('name')
+        if name:
+            ingredients = ingredient_index.search(name, self.search_limit)
+        else:
+            ingredients = ingredient_index.all()
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
 
 class RecipeViewSet(ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
-    pagination_class = PageLimitPagination
+    pagination_class = PageOrCursorPagination
     filter_backends = [filters.DjangoFilterBackend]
     filterset_class = RecipeFilter
 
+    def list(self, request, *args, **kwargs):
+        key = None
+        if request.user.is_anonymous:
+            key = get_recipe_list_cache_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        return get_cached_response(
+            key, partial(super().list, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        key = None
+        if request.user.is_anonymous:
+            key = get_recipe_detail_cache_key(request, kwargs['pk'])
+        if key is None:
+            return super().retrieve(request, *args, **kwargs)
+        return get_cached_response(
+            key, partial(super().retrieve, request, *args, **kwargs)
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if isinstance(response, Response) and isinstance(
+                response.accepted_renderer, ShoppingListRenderer):
+            # Ошибки (401, 406, неизвестный format) отдаются в JSON, а не
+            # с типом текстового или CSV-файла.
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+        return response
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        invalidate_recipes([recipe.pk])
+        schedule_image_processing(recipe)
+        transaction.on_commit(partial(refresh_recipe_snapshots, [recipe.pk]))
+
+    def perform_update(self, serializer):
+        old_image = serializer.instance.image.name
+        recipe = serializer.save()
+        if recipe.image.name != old_image:
+            # Фронтенд присылает картинку при каждом сохранении, но
+            # одинаковое содержимое получает прежнее имя в хранилище.
+            recipe.image_variants = {}
+            Recipe.objects.filter(pk=recipe.pk).update(image_variants={})
+            schedule_image_processing(recipe)
+        invalidate_recipes([recipe.pk])
+        transaction.on_commit(partial(refresh_recipe_snapshots, [recipe.pk]))
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -63,11 +162,8 @@ class RecipeViewSet(ModelViewSet):
         return super().get_serializer_class()
 
     def add_to_base(self, request, model, pk, serializer_class):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        _, created = model.objects.get_or_create(
-            recipe=recipe, user=request.user
-        )
-        if created:
+        recipe = get_object_or_404(Recipe, pk=get_pk(pk))
+        if add_memberships(model, request.user, [recipe.pk]):
             serializer = serializer_class(
                 recipe,
                 context={'request': request}
@@ -77,15 +173,12 @@ class RecipeViewSet(ModelViewSet):
                         status=HTTP_400_BAD_REQUEST)
 
     def delete_from_base(self, user, model, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        databse_obj = model.objects.filter(
-            user=user, recipe=recipe
-        )
-        if not databse_obj.exists():
-            return Response({"errors": "Обекта не существует!"},
-                            status=HTTP_400_BAD_REQUEST)
-        databse_obj.delete()
-        return Response(status=HTTP_204_NO_CONTENT)
+        pk = get_pk(pk)
+        if remove_memberships(model, user, [pk]):
+            return Response(status=HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, pk=pk)
+        return Response({"errors": "Обекта не существует!"},
+                        status=HTTP_400_BAD_REQUEST)
 
     @action(
         methods=('post', 'delete'),
@@ -107,51 +200,111 @@ class RecipeViewSet(ModelViewSet):
     )
     def shopping_cart(self, request, pk=None):
         if request.method == 'POST':
-            recipe = get_object_or_404(Recipe, id=pk)
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
-            serializer = FavoriteOrCartSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if request.method == 'DELETE':
-            recipe = ShoppingCart.objects.filter(user=request.user,
-                                                 recipe__id=pk)
-            if recipe.exists():
-                recipe.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
+            return self.add_to_base(request, ShoppingCart, pk,
+                                    FavoriteOrCartSerializer)
+        return self.delete_from_base(request.user, ShoppingCart, pk)
+
+    @action(
+        methods=('POST', 'DELETE'),
+        detail=False,
+        url_path='favorite/batch',
+        url_name='favorite-batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def favorite_batch(self, request):
+        return process_batch(request, Favorite, Recipe.objects.all())
+
+    @action(
+        methods=('POST', 'DELETE'),
+        detail=False,
+        url_path='shopping_cart/batch',
+        url_name='shopping-cart-batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def shopping_cart_batch(self, request):
+        return process_batch(request, ShoppingCart, Recipe.objects.all())
 
     @action(
         methods=('GET',),
         detail=False,
         permission_classes=(permissions.IsAuthenticated,)
     )
+    def feed(self, request):
+        recipes = get_feed_queryset(
+            self.filter_queryset(self.get_queryset()), request.user
+        )
+        page = self.paginate_queryset(recipes)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=('GET',), detail=False, url_path='by_ingredients')
+    def by_ingredients(self, request):
+        params = IngredientMatchQuerySerializer(data={
+            'ingredients': [
+                value
+                for param in request.query_params.getlist('ingredients')
+                for value in param.split(',') if value
+            ],
+            'limit': request.query_params.get('limit', 20),
+        })
+        params.is_valid(raise_exception=True)
+        ingredient_ids = params.validated_data['ingredients']
+        limit = params.validated_data['limit']
+        if settings.RECIPE_MATCH_INDEX_ENABLED:
+            recipes = self.get_matched_recipes(ingredient_ids, limit)
+        else:
+            recipes = self.get_queryset().with_ingredients(
+                ingredient_ids
+            )[:limit]
+        serializer = RecipeMatchSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
+    def get_matched_recipes(self, ingredient_ids, limit):
+        matches = recipe_match_index.search(ingredient_ids, limit)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        matched_recipes = []
+        for recipe_id, matched_count, match_ratio in matches:
+            # Индекс перестраивается с задержкой, удалённые за это время
+            # рецепты пропускаются.
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.matched_count = matched_count
+                recipe.match_ratio = match_ratio
+                matched_recipes.append(recipe)
+        return matched_recipes
+
+    @action(
+        methods=('GET',),
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS
+    )
     def download_shopping_cart(self, request):
-        cart_items = ShoppingCart.objects.filter(user=request.user)
-        cart = {}
-        for item in cart_items:
-            recipe = item.recipe
-            for ingredient in recipe.ingredients.all():
-                if ingredient.id in cart.keys():
-                    cart[
-                        ingredient.id
-                    ]['amount'] += IngredientRecipe.objects.get(
-                        recipe=recipe, ingredient=ingredient).amount
-                else:
-                    cart[ingredient.id] = {
-                        "name": ingredient.name,
-                        "amount": IngredientRecipe.objects.get(
-                            recipe=recipe,
-                            ingredient=ingredient
-                        ).amount,
-                        "measurement_unit": ingredient.measurement_unit
-                    }
-
-        result = []
-        for id, data in cart.items():
-            result.append(
-                f"{data['name']}: {data['amount']} {data['measurement_unit']}"
-            )
-        response = HttpResponse('\n'.join(result).encode(
-            'utf-8'), content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="list.txt"'
+        ingredients = IngredientRecipe.objects.filter(
+            recipe__cart__user=request.user
+        ).values(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+        ).annotate(
+            total_amount=Sum('amount')
+        ).values_list(
+            'ingredient__name',
+            'total_amount',
+            'ingredient__measurement_unit',
+        ).order_by('ingredient__name')
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.media_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="list.{renderer.format}"'
+        )
         return response
 
 
@@ -160,33 +313,66 @@ class UserRetriveAPIView(generics.RetrieveAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny, ]
 
+    def get_queryset(self):
+        return get_users_queryset(super().get_queryset(), self.request)
+
 
 class UserViewSet(BaseUserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    pagination_class = PageLimitPagination
+    pagination_class = PageOrCursorPagination
+
+    def get_queryset(self):
+        return get_users_queryset(super().get_queryset(), self.request)
 
     @action(detail=True, methods=['post', 'delete'])
     def subscribe(self, request, id):
+        id = get_pk(id)
         if request.method == 'POST':
             author = get_object_or_404(User, id=id)
-            subscription, created = Subscription.objects.get_or_create(
-                user=request.user, author=author)
-            if created:
-                serializer = self.get_serializer(author)
+            if author == request.user:
                 return Response(
-                    serializer.data,
-                    status=status.HTTP_201_CREATED
+                    {'errors': 'Нельзя подписаться на самого себя'},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-        delete_object(request, id, User, Subscription)
+            if not add_memberships(Subscription, request.user, [author.pk]):
+                return Response(
+                    {'errors': 'Вы уже подписаны на этого автора'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            serializer = SubscriptionReadSerializer(
+                author, context=self.get_serializer_context()
+            )
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if not remove_memberships(Subscription, request.user, [id]):
+            get_object_or_404(User, id=id)
+            return Response(
+                {'errors': 'Вы не подписаны на этого автора'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, methods=['get'])
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='subscribe/batch',
+        url_name='subscribe-batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def subscribe_batch(self, request):
+        return process_batch(
+            request, Subscription, User.objects.exclude(pk=request.user.pk)
+        )
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(permissions.IsAuthenticated,)
+    )
     def subscriptions(self, request):
-        user = request.user
-        subscriptions = Subscription.objects.filter(user=user)
-        authors = User.objects.filter(
-            id__in=[s.author_id for s in subscriptions])
+        authors = prefetch_recipes(
+            User.objects.filter(subscribers__user=request.user), request
+        ).order_by('-id')
 
         paged_queryset = self.paginate_queryset(authors)
         serializer = SubscriptionReadSerializer(
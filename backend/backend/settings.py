@@ -66,6 +66,27 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 600))
+MEMBERSHIP_CACHE_TIMEOUT = int(os.getenv('MEMBERSHIP_CACHE_TIMEOUT', 300))
+
+BATCH_MAX_SIZE = 100
+
+# Сколько рецептов автора отдаётся без параметра recipes_limit.
+RECIPES_LIMIT_DEFAULT = 3
+
+RECIPE_SCORE_FAVORITE_WEIGHT = 1
+RECIPE_SCORE_CART_WEIGHT = 2
+RECIPE_TRENDING_HALF_LIFE = int(os.getenv('RECIPE_TRENDING_HALF_LIFE', 72))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -98,6 +119,36 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+INGREDIENT_INDEX_ENABLED = (
+    os.getenv('INGREDIENT_INDEX_ENABLED', 'True') == 'True'
+)
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+RECIPE_MATCH_INDEX_ENABLED = (
+    os.getenv('RECIPE_MATCH_INDEX_ENABLED', 'True') == 'True'
+)
+RECIPE_MATCH_INDEX_TTL = int(os.getenv('RECIPE_MATCH_INDEX_TTL', 60))
+
+# Рецепты авторов с большим числом подписчиков не раскладываются по
+# лентам, а добавляются в ленту при чтении.
+FEED_FANOUT_MAX_SUBSCRIBERS = int(
+    os.getenv('FEED_FANOUT_MAX_SUBSCRIBERS', 10000)
+)
+FEED_BACKFILL_SIZE = 100
+
+REFERENCE_CACHE_MAX_AGE = int(os.getenv('REFERENCE_CACHE_MAX_AGE', 300))
+
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': {'size': 320, 'format': 'JPEG'},
+    'thumbnail_webp': {'size': 320, 'format': 'WEBP'},
+    'webp': {'size': 1280, 'format': 'WEBP'},
+}
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 DJOSER = {
@@ -111,6 +162,10 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
 }
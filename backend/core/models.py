@@ -0,0 +1,29 @@
+class CounterFieldsMixin:
+    """Не даёт save() перезаписать счётчики значениями из памяти.
+
+    Счётчики меняются только выражениями F() (recipes.counters) в обход
+    объектов, поэтому у загруженного заранее объекта они устаревают.
+    save() существующей строки пишет все поля, кроме counter_fields.
+    """
+    counter_fields = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if not self._state.adding and not force_insert:
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.attname not in deferred
+                ]
+            update_fields = [
+                name for name in update_fields
+                if name not in self.counter_fields
+            ]
+        super().save(
+            force_insert=force_insert,
+            force_update=force_update,
+            using=using,
+            update_fields=update_fields,
+        )
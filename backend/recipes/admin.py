@@ -41,7 +41,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='Добавлено в избранное')
     def count_favorites(self, obj: Recipe) -> int:
-        return obj.favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(Favorite)
@@ -0,0 +1,38 @@
+import time
+
+from django.core.cache import cache
+
+
+def get_cache_key(name):
+    return f'{name}_version'
+
+
+def get_version(name):
+    return cache.get_or_set(get_cache_key(name), time.time_ns, timeout=None)
+
+
+def bump_version(name):
+    version = time.time_ns()
+    cache.set(get_cache_key(name), version, timeout=None)
+    return version
+
+
+def bump_versions(names):
+    """Сбрасывает несколько версий одним обращением к кешу."""
+    version = time.time_ns()
+    cache.set_many(
+        {get_cache_key(name): version for name in names}, timeout=None
+    )
+    return version
+
+
+def get_versions(names):
+    keys = {name: get_cache_key(name) for name in names}
+    versions = cache.get_many(keys.values())
+    missing = {
+        key: time.time_ns() for key in keys.values() if key not in versions
+    }
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return {name: versions[key] for name, key in keys.items()}
@@ -0,0 +1,36 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription, User
+
+# (модель-источник, поле внешнего ключа, модель со счётчиком, счётчик)
+COUNTERS = (
+    (Favorite, 'recipe', Recipe, 'favorites_count'),
+    (ShoppingCart, 'recipe', Recipe, 'cart_count'),
+    (Recipe, 'author', User, 'recipes_count'),
+    (Subscription, 'author', User, 'subscribers_count'),
+)
+
+
+def change_counter(model, pks, field, delta):
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def count_related(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def recount_counters():
+    for model, field, counted_model, counter in COUNTERS:
+        counted_model.objects.update(
+            **{counter: count_related(model, field)}
+        )
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+
+from recipes.models import FeedItem, Recipe
+from users.models import Subscription
+
+
+def should_fan_out(author):
+    return author.subscribers_count <= settings.FEED_FANOUT_MAX_SUBSCRIBERS
+
+
+def fan_out_recipe(recipe):
+    """Раскладывает новый рецепт по лентам всех подписчиков автора одним
+    INSERT ... SELECT."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO recipes_feeditem (user_id, author_id, recipe_id) '
+            'SELECT user_id, author_id, %s FROM users_subscription '
+            'WHERE author_id = %s ON CONFLICT DO NOTHING',
+            [recipe.pk, recipe.author_id],
+        )
+
+
+def add_authors(user, author_ids):
+    """Добавляет в ленту подписчика последние рецепты новых авторов."""
+    author_ids = list(author_ids)
+    if not author_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO recipes_feeditem (user_id, author_id, recipe_id) '
+            'SELECT %s, author_id, id FROM ('
+            '    SELECT author_id, id, row_number() OVER ('
+            '        PARTITION BY author_id ORDER BY id DESC'
+            '    ) AS position'
+            '    FROM recipes_recipe'
+            '    WHERE author_id = ANY(%s) AND fanned_out'
+            ') AS recent WHERE position <= %s '
+            'ON CONFLICT DO NOTHING',
+            [user.pk, author_ids, settings.FEED_BACKFILL_SIZE],
+        )
+
+
+def remove_authors(user, author_ids):
+    FeedItem.objects.filter(user=user, author_id__in=author_ids).delete()
+
+
+def get_feed_queryset(queryset, user):
+    """Лента подписчика: рецепты из его таблицы ленты и, если есть,
+    неразосланные рецепты авторов с большим числом подписчиков."""
+    pending_authors = list(Subscription.objects.filter(user=user).filter(
+        Exists(Recipe.objects.filter(
+            author=OuterRef('author'), fanned_out=False
+        ))
+    ).values_list('author_id', flat=True))
+    if not pending_authors:
+        return queryset.filter(feed_items__user=user)
+    return queryset.filter(
+        Q(id__in=FeedItem.objects.filter(user=user).values('recipe_id'))
+        | Q(author_id__in=pending_authors, fanned_out=False)
+    )
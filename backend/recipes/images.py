@@ -0,0 +1,104 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_PATH = 'recipes/variants'
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images',
+            )
+        return _executor
+
+
+def render_variant(image, size, image_format):
+    variant = image.copy()
+    variant.thumbnail((size, size))
+    if image_format == 'JPEG' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    buffer = io.BytesIO()
+    variant.save(buffer, image_format, quality=80, optimize=True)
+    return buffer.getvalue()
+
+
+def build_variants(recipe):
+    """Сохраняет уменьшенные копии изображения рецепта и возвращает
+    словарь {название варианта: путь в хранилище}."""
+    storage = recipe.image.storage
+    stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+    with recipe.image.open('rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    variants = {}
+    for name, options in settings.RECIPE_IMAGE_VARIANTS.items():
+        extension = EXTENSIONS[options['format']]
+        variants[name] = storage.save(
+            f'{VARIANTS_PATH}/{stem}_{name}.{extension}',
+            ContentFile(render_variant(
+                image, options['size'], options['format']
+            )),
+        )
+    return variants
+
+
+def process_recipe_image(recipe_id, image_name):
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or recipe.image.name != image_name:
+        # Рецепт удалён или картинку уже заменили: этим займётся
+        # следующая задача.
+        return
+    # Файлы прежних вариантов не удаляются: в хранилище с адресацией по
+    # содержимому они могут принадлежать и другим рецептам.
+    recipe.image_variants = build_variants(recipe)
+    recipe.save(update_fields=['image_variants'])
+
+
+def run_image_task(recipe_id, image_name):
+    try:
+        process_recipe_image(recipe_id, image_name)
+    except Exception:
+        logger.exception(
+            'Не удалось обработать изображение рецепта %s', recipe_id
+        )
+
+
+def run_image_task_in_worker(recipe_id, image_name):
+    try:
+        run_image_task(recipe_id, image_name)
+    finally:
+        close_old_connections()
+
+
+def schedule_image_processing(recipe):
+    """Ставит обработку изображения в очередь после коммита транзакции.
+
+    При RECIPE_IMAGE_WORKERS = 0 обработка выполняется сразу в текущем
+    процессе.
+    """
+    args = (recipe.pk, recipe.image.name)
+    if settings.RECIPE_IMAGE_WORKERS > 0:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_image_task_in_worker, *args)
+        )
+    else:
+        transaction.on_commit(lambda: run_image_task(*args))
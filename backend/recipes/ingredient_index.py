@@ -0,0 +1,101 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+from recipes.cache_versions import bump_version, get_version
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса.
+
+    Строится при первом обращении и перестраивается, когда меняется
+    версия ингредиентов в общем кеше (её обновляют сигналы и setup_data)
+    или истекает INGREDIENT_INDEX_TTL. Порядок названий берётся из базы
+    при построении: сравнение строк в Python не совпадает с правилами
+    сортировки (collation) базы.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = None
+        self._ingredients = []
+        self._names = []
+        self._by_name = []
+        self._ordered = []
+        self._ranks = {}
+
+    def _is_stale(self, version):
+        return (
+            self._built_at is None
+            or self._version != version
+            or time.monotonic() - self._built_at
+            > settings.INGREDIENT_INDEX_TTL
+        )
+
+    def _build(self, version):
+        ordered = list(Ingredient.objects.order_by('name', 'id'))
+        by_name = sorted(
+            ordered, key=lambda ingredient: ingredient.name.lower()
+        )
+        self._ingredients = sorted(
+            ordered, key=lambda ingredient: ingredient.id
+        )
+        self._ordered = ordered
+        self._ranks = {
+            ingredient.id: rank for rank, ingredient in enumerate(ordered)
+        }
+        self._by_name = by_name
+        self._names = [ingredient.name.lower() for ingredient in by_name]
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def _load(self):
+        version = get_version('ingredients')
+        with self._lock:
+            if self._is_stale(version):
+                self._build(version)
+            return (
+                self._ingredients, self._names, self._by_name,
+                self._ordered, self._ranks
+            )
+
+    def all(self):
+        return self._load()[0]
+
+    def search(self, name, limit):
+        """Ищет как Ingredient.objects.search(): сначала названия,
+        начинающиеся с name, затем содержащие его, внутри групп - в
+        порядке сортировки базы."""
+        _, names, by_name, ordered, ranks = self._load()
+        query = name.lower()
+        # Названия с общим префиксом идут подряд и в порядке lower(),
+        # поэтому их находит bisect, а порядок базы восстанавливается
+        # сортировкой по сохранённому рангу.
+        position = bisect.bisect_left(names, query)
+        end = position
+        while end < len(names) and names[end].startswith(query):
+            end += 1
+        result = sorted(
+            by_name[position:end],
+            key=lambda ingredient: ranks[ingredient.id]
+        )[:limit]
+        for ingredient in ordered:
+            if len(result) >= limit:
+                break
+            ingredient_name = ingredient.name.lower()
+            if (query in ingredient_name
+                    and not ingredient_name.startswith(query)):
+                result.append(ingredient)
+        return result
+
+    def invalidate(self):
+        bump_version('ingredients')
+        with self._lock:
+            self._built_at = None
+
+
+ingredient_index = IngredientIndex()
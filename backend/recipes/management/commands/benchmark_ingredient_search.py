@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Измеряет время поиска ингредиентов по названию'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=['с', 'мо', 'сыр'])
+        parser.add_argument('--repeat', type=int, default=100)
+        parser.add_argument('--limit', type=int, default=50)
+
+    def handle(self, *args, **options):
+        for query in options['queries']:
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                list(Ingredient.objects.search(query)[:options['limit']])
+            elapsed = (time.perf_counter() - started) / options['repeat']
+            self.stdout.write(
+                f'{query!r}: {elapsed * 1000:.2f} мс на запрос'
+            )
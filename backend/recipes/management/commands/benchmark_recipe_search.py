@@ -0,0 +1,109 @@
+import random
+import time
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from recipes.models import Recipe, RecipeScore
+from users.models import User
+
+WORDS = (
+    'борщ', 'суп', 'салат', 'пирог', 'блины', 'котлеты', 'плов', 'каша',
+    'курица', 'говядина', 'свинина', 'рыба', 'лосось', 'грибы', 'сыр',
+    'картофель', 'морковь', 'капуста', 'свёкла', 'лук', 'чеснок', 'яйца',
+    'томатный', 'сливочный', 'домашний', 'быстрый', 'праздничный',
+    'запечённый', 'жареный', 'тушёный', 'варёный', 'острый', 'сладкий',
+    'духовка', 'сковорода', 'кастрюля', 'минут', 'перемешать', 'нарезать',
+    'посолить', 'поперчить', 'подавать', 'горячим', 'зеленью', 'сметаной',
+)
+SYLLABLES = ('ка', 'ро', 'ми', 'ту', 'ле', 'на', 'зо', 'пи', 'ва', 'сы', 'до',
+             'ге')
+# Слова-наполнители, чтобы частоты слов были ближе к настоящим текстам.
+FILLER = tuple(
+    first + second + third
+    for first in SYLLABLES for second in SYLLABLES for third in SYLLABLES
+)
+
+
+class Command(BaseCommand):
+    help = ('Измеряет время полнотекстового поиска рецептов, при '
+            'необходимости создавая синтетические рецепты')
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=[
+            'борщ', 'курица духовка', 'сырный пирог', 'грибы -суп'
+        ])
+        parser.add_argument(
+            '--generate',
+            type=int,
+            default=0,
+            help='Сколько синтетических рецептов создать перед замером',
+        )
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument(
+            '--compare',
+            action='store_true',
+            help='Сравнить с поиском через icontains',
+        )
+
+    def generate(self, count, batch_size=5000):
+        author, _ = User.objects.get_or_create(
+            username='search_benchmark',
+            defaults={'email': 'search_benchmark@example.com'},
+        )
+        for start in range(0, count, batch_size):
+            recipes = Recipe.objects.bulk_create([
+                Recipe(
+                    author=author,
+                    name=' '.join(random.choices(WORDS, k=3)),
+                    text=' '.join(
+                        random.choices(WORDS, k=3)
+                        + random.choices(FILLER, k=40)
+                    ),
+                    cooking_time=random.randint(5, 180),
+                    image='recipes/images/benchmark.png',
+                )
+                for _ in range(min(batch_size, count - start))
+            ])
+            RecipeScore.objects.bulk_create(
+                RecipeScore(recipe=recipe) for recipe in recipes
+            )
+        self.stdout.write(f'Создано рецептов: {count}')
+
+    def measure(self, label, get_queryset, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            list(get_queryset())
+        elapsed = (time.perf_counter() - started) / repeat
+        self.stdout.write(f'{label}: {elapsed * 1000:.2f} мс на запрос')
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            self.generate(options['generate'])
+        limit = options['limit']
+        for value in options['queries']:
+            query = SearchQuery(
+                value, config='russian', search_type='websearch'
+            )
+            self.measure(
+                f'{value!r} search_vector',
+                lambda: Recipe.objects.filter(search_vector=query).annotate(
+                    rank=SearchRank(F('search_vector'), query)
+                ).order_by('-rank', '-id').values('id')[:limit],
+                options['repeat'],
+            )
+            if options['compare']:
+                words = Q()
+                for word in value.split():
+                    words &= Q(name__icontains=word) | Q(
+                        text__icontains=word
+                    )
+                self.measure(
+                    f'{value!r} icontains',
+                    lambda: Recipe.objects.filter(words).values('id')[
+                        :limit
+                    ],
+                    options['repeat'],
+                )
@@ -0,0 +1,58 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import VARIANTS_PATH
+from recipes.models import Recipe
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for filename in files:
+        yield posixpath.join(path, filename)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+
+
+class Command(BaseCommand):
+    help = ('Удаляет изображения рецептов и их варианты, на которые '
+            'не ссылается ни один рецепт')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=24,
+            help='Не трогать файлы моложе указанного числа часов',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, какие файлы будут удалены',
+        )
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        storage = field.storage
+        referenced = set()
+        for image, variants in Recipe.objects.values_list(
+                'image', 'image_variants').iterator():
+            referenced.add(image)
+            referenced.update(variants.values())
+        threshold = timezone.now() - timedelta(hours=options['min_age'])
+        removed = 0
+        for root in (field.upload_to, VARIANTS_PATH):
+            if not storage.exists(root):
+                continue
+            for path in walk(storage, root):
+                if (path in referenced
+                        or storage.get_modified_time(path) > threshold):
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(path)
+                else:
+                    storage.delete(path)
+                removed += 1
+        self.stdout.write(f'Неиспользуемых файлов: {removed}')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import run_image_task
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии для всех рецептов, а не только '
+                 'для тех, у которых их ещё нет',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        count = 0
+        for recipe_id, image_name in recipes.values_list('id', 'image'):
+            run_image_task(recipe_id, image_name)
+            count += 1
+        self.stdout.write(f'Обработано изображений: {count}')
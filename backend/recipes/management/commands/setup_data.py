@@ -2,6 +2,7 @@ import json
 
 from django.core.management.base import BaseCommand
 
+from recipes.ingredient_index import ingredient_index
 from recipes.models import Ingredient
 
 
@@ -15,5 +16,6 @@ class Command(BaseCommand):
                 Ingredient.objects.bulk_create([
                     Ingredient(**row) for row in data
                 ])
+                ingredient_index.invalidate()
             except Exception as e:
                 print('Произошла ошибка:', e)
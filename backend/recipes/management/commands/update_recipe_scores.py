@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipes.cache_versions import bump_version
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинги рецептов для сортировки popular/trending'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать все рецепты, а не только изменившиеся',
+        )
+
+    def handle(self, *args, **options):
+        count = refresh_scores(full=options['full'])
+        bump_version('recipe_lists')
+        self.stdout.write(f'Обновлено рейтингов: {count}')
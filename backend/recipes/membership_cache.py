@@ -0,0 +1,105 @@
+from array import array
+from bisect import bisect_left
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from recipes.cache_versions import bump_version, get_versions
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscription
+
+# название множества: (модель, поле с id объекта)
+MEMBERSHIP_SETS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'cart': (ShoppingCart, 'recipe_id'),
+    'subscriptions': (Subscription, 'author_id'),
+}
+
+
+class MembershipIds:
+    """Отсортированный массив id с проверкой принадлежности за O(log n)."""
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __contains__(self, pk):
+        position = bisect_left(self.ids, pk)
+        return position < len(self.ids) and self.ids[position] == pk
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def is_cache_shared():
+    """Массивы кешируются только в общем для всех процессов кеше: копию
+    в LocMemCache другой процесс не сбросит после изменения."""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def get_set_name(model):
+    for name, (set_model, _) in MEMBERSHIP_SETS.items():
+        if set_model is model:
+            return name
+    raise ValueError(f'Для модели {model.__name__} нет множества id')
+
+
+def get_version_name(name, user_id):
+    return f'{name}_ids_{user_id}'
+
+
+def get_ids_key(name, user_id, version):
+    return f'{get_version_name(name, user_id)}_{version}'
+
+
+def load_ids(name, user_id):
+    model, field = MEMBERSHIP_SETS[name]
+    return array('q', model.objects.filter(user_id=user_id).order_by(
+        field
+    ).values_list(field, flat=True))
+
+
+def get_membership_ids(user_id, names=tuple(MEMBERSHIP_SETS)):
+    """Множества id пользователя из общего кеша: два обращения к кешу
+    на все множества и запрос в базу только для отсутствующих."""
+    if not is_cache_shared():
+        return {name: MembershipIds(load_ids(name, user_id)) for name in names}
+    versions = get_versions(
+        [get_version_name(name, user_id) for name in names]
+    )
+    keys = {
+        name: get_ids_key(
+            name, user_id, versions[get_version_name(name, user_id)]
+        )
+        for name in names
+    }
+    cached = cache.get_many(keys.values())
+    missing = {}
+    result = {}
+    for name, key in keys.items():
+        if key not in cached:
+            cached[key] = missing[key] = load_ids(name, user_id)
+        result[name] = MembershipIds(cached[key])
+    if missing:
+        cache.set_many(missing, timeout=settings.MEMBERSHIP_CACHE_TIMEOUT)
+    return result
+
+
+def refresh_membership_ids(model, user_id):
+    # Новая версия делает недоступными массивы, которые другие процессы
+    # могли прочитать из базы до изменения и положить в кеш после него.
+    name = get_set_name(model)
+    version = bump_version(get_version_name(name, user_id))
+    cache.set(
+        get_ids_key(name, user_id, version),
+        load_ids(name, user_id),
+        timeout=settings.MEMBERSHIP_CACHE_TIMEOUT,
+    )
+
+
+def schedule_refresh(model, user_id):
+    if not is_cache_shared():
+        return
+    transaction.on_commit(partial(refresh_membership_ids, model, user_id))
@@ -0,0 +1,80 @@
+from django.db import connection, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from recipes.counters import COUNTERS, change_counter
+
+# Отправляются с sender=model, user и target_ids - id объектов, для
+# которых запись действительно добавлена или удалена.
+memberships_added = Signal()
+memberships_removed = Signal()
+
+
+def get_counter(model):
+    for counter_model, field, counted_model, counter in COUNTERS:
+        if counter_model is model:
+            return model._meta.get_field(field).column, counted_model, counter
+    raise ValueError(f'Для модели {model.__name__} нет счётчика')
+
+
+def add_memberships(model, user, target_ids):
+    """Добавляет записи одним INSERT ... ON CONFLICT DO NOTHING и
+    возвращает id объектов, для которых запись действительно создана."""
+    target_ids = list(target_ids)
+    if not target_ids:
+        return set()
+    column, counted_model, counter = get_counter(model)
+    columns = ['user_id', column]
+    extra = []
+    if any(field.name == 'created' for field in model._meta.fields):
+        columns.append('created')
+        extra.append(timezone.now())
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(
+        f'({", ".join(["%s"] * len(columns))})' for _ in target_ids
+    )
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} '
+        f'({", ".join(quote(name) for name in columns)}) '
+        f'VALUES {placeholders} ON CONFLICT DO NOTHING '
+        f'RETURNING {quote(column)}'
+    )
+    params = [
+        value
+        for target_id in target_ids
+        for value in (user.pk, target_id, *extra)
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        created = {row[0] for row in cursor.fetchall()}
+        if created:
+            change_counter(counted_model, created, counter, 1)
+            memberships_added.send(
+                sender=model, user=user, target_ids=created
+            )
+    return created
+
+
+def remove_memberships(model, user, target_ids):
+    """Удаляет записи одним DELETE ... RETURNING и возвращает id
+    объектов, для которых запись действительно была удалена."""
+    target_ids = list(target_ids)
+    if not target_ids:
+        return set()
+    column, counted_model, counter = get_counter(model)
+    quote = connection.ops.quote_name
+    sql = (
+        f'DELETE FROM {quote(model._meta.db_table)} '
+        f'WHERE {quote("user_id")} = %s '
+        f'AND {quote(column)} IN ({", ".join(["%s"] * len(target_ids))}) '
+        f'RETURNING {quote(column)}'
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, *target_ids])
+        deleted = {row[0] for row in cursor.fetchall()}
+        if deleted:
+            change_counter(counted_model, deleted, counter, -1)
+            memberships_removed.send(
+                sender=model, user=user, target_ids=deleted
+            )
+    return deleted
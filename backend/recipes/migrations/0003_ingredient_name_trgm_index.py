@@ -0,0 +1,29 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:43
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredientrecipe',
+            name='ingredient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.ingredient', verbose_name='Ингредиент'),
+        ),
+        TrigramExtension(),
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX recipes_ingredient_name_trgm_idx '
+                'ON recipes_ingredient '
+                'USING gin (UPPER(name::text) gin_trgm_ops);'
+            ),
+            reverse_sql='DROP INDEX recipes_ingredient_name_trgm_idx;',
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 3.2.3 on 2026-10-18 07:30
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+INGREDIENT_IDS_TRIGGERS = '''
+CREATE FUNCTION recipes_recipe_ingredient_ids_update() RETURNS trigger AS $$
+BEGIN
+    NEW.ingredient_ids := ARRAY(
+        SELECT DISTINCT ingredient_id FROM recipes_ingredientrecipe
+        WHERE recipe_id = NEW.id ORDER BY ingredient_id
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER recipes_recipe_ingredient_ids_trigger
+BEFORE UPDATE OF ingredient_ids ON recipes_recipe
+FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_ingredient_ids_update();
+
+-- Триггеры уровня оператора: bulk_create и удаление рецепта
+-- пересчитывают массив каждого рецепта один раз, а не на каждую строку.
+CREATE FUNCTION recipes_ingredientrecipe_refresh_recipes() RETURNS trigger
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE recipes_recipe SET ingredient_ids = '{}'
+        WHERE id IN (SELECT recipe_id FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE recipes_recipe SET ingredient_ids = '{}'
+        WHERE id IN (SELECT recipe_id FROM old_rows);
+    ELSE
+        UPDATE recipes_recipe SET ingredient_ids = '{}'
+        WHERE id IN (
+            SELECT unnest(ARRAY[old_row.recipe_id, new_row.recipe_id])
+            FROM old_rows AS old_row
+            JOIN new_rows AS new_row ON new_row.id = old_row.id
+            WHERE old_row.recipe_id <> new_row.recipe_id
+            OR old_row.ingredient_id <> new_row.ingredient_id
+        );
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER recipes_ingredientrecipe_insert_trigger
+AFTER INSERT ON recipes_ingredientrecipe
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE recipes_ingredientrecipe_refresh_recipes();
+
+CREATE TRIGGER recipes_ingredientrecipe_update_trigger
+AFTER UPDATE ON recipes_ingredientrecipe
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE recipes_ingredientrecipe_refresh_recipes();
+
+CREATE TRIGGER recipes_ingredientrecipe_delete_trigger
+AFTER DELETE ON recipes_ingredientrecipe
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE recipes_ingredientrecipe_refresh_recipes();
+
+UPDATE recipes_recipe SET ingredient_ids = '{}';
+'''
+
+DROP_INGREDIENT_IDS_TRIGGERS = '''
+DROP TRIGGER recipes_ingredientrecipe_insert_trigger
+ON recipes_ingredientrecipe;
+DROP TRIGGER recipes_ingredientrecipe_update_trigger
+ON recipes_ingredientrecipe;
+DROP TRIGGER recipes_ingredientrecipe_delete_trigger
+ON recipes_ingredientrecipe;
+DROP FUNCTION recipes_ingredientrecipe_refresh_recipes();
+DROP TRIGGER recipes_recipe_ingredient_ids_trigger ON recipes_recipe;
+DROP FUNCTION recipes_recipe_ingredient_ids_update();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='recipe_ingredient_ids_idx'),
+        ),
+        migrations.RunSQL(
+            sql=INGREDIENT_IDS_TRIGGERS,
+            reverse_sql=DROP_INGREDIENT_IDS_TRIGGERS,
+        ),
+    ]
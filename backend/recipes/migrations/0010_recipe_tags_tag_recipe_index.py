@@ -0,0 +1,22 @@
+# Generated by Django 3.2.3 on 2026-10-18 08:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_ingredient_ids'),
+    ]
+
+    operations = [
+        # Уникальный индекс (recipe_id, tag_id) создан вместе с таблицей;
+        # обратный порядок нужен, когда фильтр по тегам начинается с тегов.
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX recipe_tags_tag_recipe_idx '
+                'ON recipes_recipe_tags (tag_id, recipe_id);'
+            ),
+            reverse_sql='DROP INDEX recipe_tags_tag_recipe_idx;',
+        ),
+    ]
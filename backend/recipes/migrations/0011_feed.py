@@ -0,0 +1,83 @@
+# Generated by Django 3.2.3 on 2026-10-18 08:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_feed(apps, schema_editor):
+    # Рецепты авторов с небольшим числом подписчиков раскладываются по
+    # лентам сразу, остальные останутся неразосланными и будут
+    # добавляться в ленту при чтении.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO recipes_feeditem (user_id, author_id, recipe_id) '
+            'SELECT subscription.user_id, recipe.author_id, recipe.id '
+            'FROM recipes_recipe AS recipe '
+            'JOIN users_subscription AS subscription '
+            'ON subscription.author_id = recipe.author_id '
+            'JOIN users_user AS author ON author.id = recipe.author_id '
+            'WHERE author.subscribers_count <= %s',
+            [settings.FEED_FANOUT_MAX_SUBSCRIBERS],
+        )
+        cursor.execute(
+            'UPDATE recipes_recipe SET fanned_out = true '
+            'WHERE author_id IN ('
+            '    SELECT id FROM users_user WHERE subscribers_count <= %s'
+            ')',
+            [settings.FEED_FANOUT_MAX_SUBSCRIBERS],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0010_recipe_tags_tag_recipe_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='fanned_out',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Разослан в ленты подписчиков'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['author', '-id'], name='recipe_not_fanned_out_idx'),
+        ),
+        migrations.AddField(
+            model_name='feeditem',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AddField(
+            model_name='feeditem',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddField(
+            model_name='feeditem',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик'),
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', 'author'], name='feed_item_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_item'),
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
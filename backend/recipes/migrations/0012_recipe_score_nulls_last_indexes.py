@@ -0,0 +1,53 @@
+# Generated by Django 3.2.3 on 2026-10-18 09:30
+
+import django.db.models.expressions
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_scores(apps, schema_editor):
+    # Рецептам без рейтинга создаются строки с популярностью по счётчикам;
+    # затухающий рейтинг досчитает update_recipe_scores.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO recipes_recipescore (recipe_id, popular, trending) '
+            'SELECT id, favorites_count * %s + cart_count * %s, 0 '
+            'FROM recipes_recipe '
+            'ON CONFLICT (recipe_id) DO NOTHING',
+            [
+                settings.RECIPE_SCORE_FAVORITE_WEIGHT,
+                settings.RECIPE_SCORE_CART_WEIGHT,
+            ],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_feed'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recipescore',
+            name='recipe_score_popular_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='recipescore',
+            name='recipe_score_trending_idx',
+        ),
+        migrations.AlterField(
+            model_name='recipescore',
+            name='updated',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата пересчёта'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(django.db.models.expressions.OrderBy(django.db.models.expressions.F('popular'), descending=True, nulls_last=True), django.db.models.expressions.OrderBy(django.db.models.expressions.F('recipe'), descending=True), name='recipe_score_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(django.db.models.expressions.OrderBy(django.db.models.expressions.F('trending'), descending=True, nulls_last=True), django.db.models.expressions.OrderBy(django.db.models.expressions.F('recipe'), descending=True), name='recipe_score_trending_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_score_nulls_last_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipescore',
+            name='trending',
+            field=models.FloatField(blank=True, null=True, verbose_name='Популярность с затуханием'),
+        ),
+        # Прежние рейтинги хранили 0 вместо пустого значения, поэтому все
+        # строки помечаются для пересчёта.
+        migrations.RunSQL(
+            'UPDATE recipes_recipescore SET updated = NULL',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,6 +1,13 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models.expressions import Func, RawSQL
+from django.db.models.functions import Greatest
 
+from core.models import CounterFieldsMixin
+from recipes.storage import ContentAddressedStorage
 from users.models import User
 
 
@@ -34,6 +41,18 @@ class Tag(models.Model):
         return self.name
 
 
+class IngredientQuerySet(models.QuerySet):
+
+    def search(self, name):
+        return self.filter(name__icontains=name).annotate(
+            is_prefix_match=models.Case(
+                models.When(name__istartswith=name, then=models.Value(True)),
+                default=models.Value(False),
+                output_field=models.BooleanField(),
+            )
+        ).order_by('-is_prefix_match', 'name')
+
+
 class Ingredient(models.Model):
     name = models.CharField(
         'Название ингредиента',
@@ -44,6 +63,8 @@ class Ingredient(models.Model):
         max_length=200
     )
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -88,7 +109,37 @@ class IngredientRecipe(models.Model):
         )
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_ingredients(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ингредиентов,
+        по убыванию доли ингредиентов рецепта, которые уже есть."""
+        ingredient_ids = sorted(set(ingredient_ids))
+        matched_count = RawSQL(
+            'SELECT count(*) FROM unnest(recipes_recipe.ingredient_ids) '
+            'AS ingredient_id WHERE ingredient_id = ANY(%s)',
+            (ingredient_ids,),
+            output_field=models.IntegerField(),
+        )
+        return self.filter(
+            ingredient_ids__overlap=ingredient_ids
+        ).annotate(
+            matched_count=matched_count,
+            match_ratio=models.ExpressionWrapper(
+                models.F('matched_count') * 1.0 / Greatest(
+                    Func(
+                        models.F('ingredient_ids'),
+                        function='cardinality',
+                        output_field=models.IntegerField(),
+                    ),
+                    1,
+                ),
+                output_field=models.FloatField(),
+            ),
+        ).order_by('-match_ratio', '-matched_count', '-id')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -102,6 +153,13 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Изображение',
         upload_to='recipes/images',
+        storage=ContentAddressedStorage(),
+    )
+    image_variants = models.JSONField(
+        'Варианты изображения',
+        default=dict,
+        blank=True,
+        editable=False,
     )
     text = models.TextField(verbose_name='Описание')
     cooking_time = models.PositiveIntegerField(
@@ -115,11 +173,52 @@ class Recipe(models.Model):
         through_fields=('recipe', 'ingredient'),
         verbose_name='Ингредиенты'
     )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        'Добавлений в корзину',
+        default=0,
+        editable=False,
+    )
+    # Заполняется триггером в базе из name (вес A) и text (вес B).
+    search_vector = SearchVectorField(null=True, editable=False)
+    fanned_out = models.BooleanField(
+        'Разослан в ленты подписчиков',
+        default=False,
+        editable=False,
+    )
+    # Заполняется триггером в базе по строкам IngredientRecipe.
+    ingredient_ids = ArrayField(
+        models.BigIntegerField(),
+        default=list,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'cart_count')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-id']
+        indexes = [
+            GinIndex(
+                fields=('search_vector',),
+                name='recipe_search_vector_idx'
+            ),
+            GinIndex(
+                fields=('ingredient_ids',),
+                name='recipe_ingredient_ids_idx'
+            ),
+            models.Index(
+                fields=('author', '-id'),
+                condition=models.Q(fanned_out=False),
+                name='recipe_not_fanned_out_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -138,6 +237,11 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -167,6 +271,11 @@ class ShoppingCart(models.Model):
         related_name='cart',
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Корзина покупок'
@@ -181,3 +290,81 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в корзину покупок '
+
+
+class RecipeScore(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт'
+    )
+    popular = models.FloatField('Популярность', default=0)
+    # Пустое значение - у рецепта не было событий.
+    trending = models.FloatField(
+        'Популярность с затуханием', null=True, blank=True
+    )
+    # Пустая дата означает, что рейтинг нужно пересчитать.
+    updated = models.DateTimeField('Дата пересчёта', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        # Порядок совпадает с RecipeFilter.get_ordering: в PostgreSQL
+        # DESC по умолчанию означает NULLS FIRST.
+        indexes = [
+            models.Index(
+                models.F('popular').desc(nulls_last=True),
+                models.F('recipe').desc(),
+                name='recipe_score_popular_idx'
+            ),
+            models.Index(
+                models.F('trending').desc(nulls_last=True),
+                models.F('recipe').desc(),
+                name='recipe_score_trending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}: {self.popular} / {self.trending}'
+
+
+class FeedItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Подписчик'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_item'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', 'author'),
+                name='feed_item_user_author_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
@@ -0,0 +1,178 @@
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from recipes.models import Recipe
+
+
+def to_bitset(positions, size):
+    bits = bytearray(size // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class RecipeMatchIndex:
+    """Инвертированный индекс ингредиент -> рецепты в памяти процесса.
+
+    Рецепт - это номер бита (рецепты упорядочены по id), частые
+    ингредиенты хранятся готовыми битовыми множествами, редкие - списком
+    номеров. Индекс строится по Recipe.ingredient_ids и перестраивается
+    в фоне раз в RECIPE_MATCH_INDEX_TTL секунд, поэтому новые рецепты
+    появляются в выдаче с задержкой.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._rebuilding = False
+        self._recipe_ids = array('q')
+        self._postings = {}
+        self._lengths = {}
+
+    def _is_stale(self):
+        return (
+            self._built_at is None
+            or time.monotonic() - self._built_at
+            > settings.RECIPE_MATCH_INDEX_TTL
+        )
+
+    def _build(self):
+        recipe_ids = array('q')
+        postings = {}
+        lengths = {}
+        recipes = Recipe.objects.order_by('id').values_list(
+            'id', 'ingredient_ids'
+        )
+        for position, (recipe_id, ingredient_ids) in enumerate(
+                recipes.iterator(chunk_size=10000)):
+            recipe_ids.append(recipe_id)
+            if not ingredient_ids:
+                continue
+            for ingredient_id in ingredient_ids:
+                postings.setdefault(ingredient_id, array('i')).append(
+                    position
+                )
+            lengths.setdefault(len(ingredient_ids), array('i')).append(
+                position
+            )
+        size = len(recipe_ids)
+        for ingredient_id, positions in postings.items():
+            # Битовое множество занимает size / 8 байт, список - 4 байта
+            # на рецепт: частые ингредиенты выгоднее хранить битами.
+            if len(positions) * 32 > size:
+                postings[ingredient_id] = to_bitset(positions, size)
+        lengths = {
+            length: to_bitset(positions, size)
+            for length, positions in lengths.items()
+        }
+        return recipe_ids, postings, lengths
+
+    def _rebuild(self):
+        try:
+            recipe_ids, postings, lengths = self._build()
+            with self._lock:
+                self._recipe_ids = recipe_ids
+                self._postings = postings
+                self._lengths = lengths
+                self._built_at = time.monotonic()
+        finally:
+            self._rebuilding = False
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild()
+        finally:
+            close_old_connections()
+
+    def _load(self):
+        if self._built_at is None:
+            # Первое построение (или после invalidate) ждут все запросы.
+            with self._build_lock:
+                if self._built_at is None:
+                    self._rebuilding = True
+                    self._rebuild()
+        with self._lock:
+            start_rebuild = self._is_stale() and not self._rebuilding
+            if start_rebuild:
+                self._rebuilding = True
+            index = self._recipe_ids, self._postings, self._lengths
+        if start_rebuild:
+            threading.Thread(
+                target=self._rebuild_in_background, daemon=True
+            ).start()
+        return index
+
+    def search(self, ingredient_ids, limit):
+        """Возвращает до limit кортежей (id рецепта, число совпавших
+        ингредиентов, доля совпавших ингредиентов рецепта) в порядке
+        убывания доли, затем числа совпадений, затем id."""
+        recipe_ids, postings, lengths = self._load()
+        size = len(recipe_ids)
+        # Побитовые счётчики: в counters[i] i-й бит числа совпадений
+        # каждого рецепта.
+        counters = []
+        matched_any = 0
+        found = 0
+        for ingredient_id in set(ingredient_ids):
+            bitset = postings.get(ingredient_id)
+            if bitset is None:
+                continue
+            found += 1
+            if not isinstance(bitset, int):
+                bitset = to_bitset(bitset, size)
+            matched_any |= bitset
+            carry = bitset
+            for level, counter in enumerate(counters):
+                counters[level], carry = counter ^ carry, counter & carry
+                if not carry:
+                    break
+            else:
+                if carry:
+                    counters.append(carry)
+        if not matched_any:
+            return []
+
+        def matched_exactly(count):
+            if count >> len(counters):
+                return 0
+            bitset = matched_any
+            for level, counter in enumerate(counters):
+                bitset &= counter if count >> level & 1 else ~counter
+            return bitset
+
+        pairs = sorted(
+            (
+                (matched, length)
+                for length in lengths
+                for matched in range(1, min(length, found) + 1)
+            ),
+            key=lambda pair: (pair[0] / pair[1], pair[0]),
+            reverse=True,
+        )
+        exact = {}
+        result = []
+        for matched, length in pairs:
+            if matched not in exact:
+                exact[matched] = matched_exactly(matched)
+            candidates = exact[matched] & lengths[length]
+            while candidates and len(result) < limit:
+                position = candidates.bit_length() - 1
+                candidates ^= 1 << position
+                result.append(
+                    (recipe_ids[position], matched, matched / length)
+                )
+            if len(result) >= limit:
+                break
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+
+recipe_match_index = RecipeMatchIndex()
@@ -0,0 +1,109 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as django_timezone
+
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingCart
+
+# Затухающий рейтинг хранится в логарифмической шкале относительно
+# фиксированной точки отсчёта: log(sum(w * 2 ** ((t - EPOCH) / T))).
+# Порядок рецептов совпадает с порядком по sum(w * 2 ** ((t - now) / T)),
+# поэтому старые оценки не нужно пересчитывать с течением времени.
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+CHUNK_SIZE = 1000
+
+
+def get_event_weight(created, weight):
+    half_life = settings.RECIPE_TRENDING_HALF_LIFE * 3600
+    age = (created - EPOCH).total_seconds()
+    return math.log(weight) + age / half_life * math.log(2)
+
+
+def log_add(first, second):
+    if first is None:
+        return second
+    high, low = max(first, second), min(first, second)
+    return high + math.log1p(math.exp(low - high))
+
+
+def compute_scores(recipe_ids):
+    # Без событий затухающий рейтинг - None: log-шкала отрицательна для
+    # событий до EPOCH, и 0 поднял бы такие рецепты выше них.
+    trending = defaultdict(lambda: None)
+    for model, weight in (
+        (Favorite, settings.RECIPE_SCORE_FAVORITE_WEIGHT),
+        (ShoppingCart, settings.RECIPE_SCORE_CART_WEIGHT),
+    ):
+        events = model.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'created')
+        for recipe_id, created in events.iterator():
+            trending[recipe_id] = log_add(
+                trending[recipe_id], get_event_weight(created, weight)
+            )
+    counters = Recipe.objects.filter(id__in=recipe_ids).values_list(
+        'id', 'favorites_count', 'cart_count'
+    )
+    return {
+        recipe_id: (
+            favorites_count * settings.RECIPE_SCORE_FAVORITE_WEIGHT
+            + cart_count * settings.RECIPE_SCORE_CART_WEIGHT,
+            trending[recipe_id],
+        )
+        for recipe_id, favorites_count, cart_count in counters
+    }
+
+
+def mark_scores_stale(recipe_ids):
+    """Пустая дата пересчёта - рейтинг пересчитает следующий запуск."""
+    RecipeScore.objects.filter(recipe_id__in=recipe_ids).update(updated=None)
+
+
+def refresh_chunk(recipe_ids, updated):
+    with transaction.atomic():
+        # Строки, которые сейчас меняет другая транзакция, пропускаются:
+        # после её коммита дата пересчёта снова будет пустой. Строки,
+        # помеченные после захвата, ждут этого коммита и тоже попадут в
+        # следующий запуск.
+        claimed = list(RecipeScore.objects.select_for_update(
+            skip_locked=True
+        ).filter(recipe_id__in=recipe_ids).values_list('recipe_id', flat=True))
+        RecipeScore.objects.bulk_update(
+            [
+                RecipeScore(
+                    recipe_id=recipe_id,
+                    popular=popular,
+                    trending=trending,
+                    updated=updated,
+                )
+                for recipe_id, (popular, trending)
+                in compute_scores(claimed).items()
+            ],
+            ('popular', 'trending', 'updated'),
+        )
+    return len(claimed)
+
+
+def refresh_scores(full=False):
+    updated = django_timezone.now()
+    if full:
+        RecipeScore.objects.bulk_create(
+            [
+                RecipeScore(recipe_id=recipe_id)
+                for recipe_id in Recipe.objects.filter(
+                    score__isnull=True
+                ).values_list('id', flat=True)
+            ],
+            ignore_conflicts=True,
+        )
+        scores = RecipeScore.objects.all()
+    else:
+        scores = RecipeScore.objects.filter(updated__isnull=True)
+    recipe_ids = list(scores.values_list('recipe_id', flat=True))
+    return sum(
+        refresh_chunk(recipe_ids[start:start + CHUNK_SIZE], updated)
+        for start in range(0, len(recipe_ids), CHUNK_SIZE)
+    )
@@ -0,0 +1,121 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from recipes.cache_versions import bump_version
+from recipes.counters import COUNTERS, change_counter
+from recipes.feed import (add_authors, fan_out_recipe, remove_authors,
+                          should_fan_out)
+from recipes.ingredient_index import ingredient_index
+from recipes.membership_cache import MEMBERSHIP_SETS, schedule_refresh
+from recipes.memberships import memberships_added, memberships_removed
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeScore,
+                            ShoppingCart, Tag)
+from recipes.scores import mark_scores_stale
+from users.models import Subscription
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(**kwargs):
+    bump_version('tags')
+
+
+@receiver(pre_save, sender=Recipe)
+def mark_recipe_fan_out(instance, raw=False, **kwargs):
+    if instance._state.adding and not raw:
+        instance.fanned_out = should_fan_out(instance.author)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_new_recipe(instance, created, raw=False, **kwargs):
+    if created and not raw and instance.fanned_out:
+        fan_out_recipe(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(instance, created, raw=False, **kwargs):
+    # Сортировка по рейтингу соединяет рецепты с рейтингами через INNER
+    # JOIN, поэтому строка рейтинга нужна каждому рецепту.
+    if created and not raw:
+        RecipeScore.objects.create(recipe=instance)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def mark_recipe_score_stale(instance, raw=False, **kwargs):
+    if not raw:
+        mark_scores_stale([instance.recipe_id])
+
+
+@receiver((memberships_added, memberships_removed), sender=Favorite)
+@receiver((memberships_added, memberships_removed), sender=ShoppingCart)
+def mark_recipe_scores_stale(target_ids, **kwargs):
+    mark_scores_stale(target_ids)
+
+
+@receiver(post_save, sender=Subscription)
+def add_author_to_feed(instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add_authors(instance.user, [instance.author_id])
+
+
+@receiver(post_delete, sender=Subscription)
+def remove_author_from_feed(instance, **kwargs):
+    remove_authors(instance.user, [instance.author_id])
+
+
+@receiver(memberships_added, sender=Subscription)
+def add_authors_to_feed(user, target_ids, **kwargs):
+    add_authors(user, target_ids)
+
+
+@receiver(memberships_removed, sender=Subscription)
+def remove_authors_from_feed(user, target_ids, **kwargs):
+    remove_authors(user, target_ids)
+
+
+def connect_membership_cache(model):
+
+    def refresh_saved(instance, created, raw=False, **kwargs):
+        if created and not raw:
+            schedule_refresh(model, instance.user_id)
+
+    def refresh_deleted(instance, **kwargs):
+        schedule_refresh(model, instance.user_id)
+
+    def refresh_changed(user, **kwargs):
+        schedule_refresh(model, user.pk)
+
+    post_save.connect(refresh_saved, sender=model, weak=False)
+    post_delete.connect(refresh_deleted, sender=model, weak=False)
+    memberships_added.connect(refresh_changed, sender=model, weak=False)
+    memberships_removed.connect(refresh_changed, sender=model, weak=False)
+
+
+def connect_counter(model, field, counted_model, counter):
+    attname = model._meta.get_field(field).attname
+
+    def increment(instance, created, raw=False, **kwargs):
+        if created and not raw:
+            change_counter(
+                counted_model, [getattr(instance, attname)], counter, 1
+            )
+
+    def decrement(instance, **kwargs):
+        change_counter(
+            counted_model, [getattr(instance, attname)], counter, -1
+        )
+
+    post_save.connect(increment, sender=model, weak=False)
+    post_delete.connect(decrement, sender=model, weak=False)
+
+
+for counter_args in COUNTERS:
+    connect_counter(*counter_args)
+
+for membership_model, _ in MEMBERSHIP_SETS.values():
+    connect_membership_cache(membership_model)
@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - sha256 его содержимого.
+
+    Одинаковые файлы хранятся один раз: при повторной загрузке
+    возвращается уже сохранённый файл. Удалять файлы напрямую нельзя,
+    на них могут ссылаться другие рецепты, - этим занимается команда
+    collect_media_garbage.
+    """
+
+    chunk_size = 64 * 1024
+
+    def get_hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(self.chunk_size):
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        hexdigest = digest.hexdigest()
+        return os.path.join(
+            directory, hexdigest[:2], f'{hexdigest}{extension}'
+        ).replace('\\', '/')
+
+    def _save(self, name, content):
+        name = self.get_hashed_name(name, content)
+        if self.exists(name):
+            # Обновляем время изменения, чтобы сборщик мусора не удалил
+            # файл, на который вот-вот сошлётся новая запись.
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
@@ -1,15 +1,28 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from core.models import CounterFieldsMixin
 
-class User(AbstractUser):
+
+class User(CounterFieldsMixin, AbstractUser):
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
     USERNAME_FIELD = 'email'
+    counter_fields = ('recipes_count', 'subscribers_count')
     email = models.EmailField(
         unique=True,
         max_length=254,
         verbose_name='email'
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
 
 class Subscription(models.Model):